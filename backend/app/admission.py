@@ -0,0 +1,252 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException, Request
+
+# Default token bucket per client: sustained requests per minute and burst
+# size. 0 disables rate limiting.
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+# Per-client overrides: "key=per_minute/burst,key2=per_minute/burst"
+CLIENT_RATE_LIMITS = os.environ.get("CLIENT_RATE_LIMITS", "")
+# API keys clients may identify with. A request with any other key (or
+# none) is keyed on its IP address, so made-up keys cannot buy fresh buckets.
+API_KEYS = {key for key in os.environ.get("API_KEYS", "").split(",") if key}
+# API keys whose traffic is always scheduled as bulk
+BULK_CLIENTS = {key for key in os.environ.get("BULK_CLIENTS", "").split(",") if key}
+# Request class of clients without a valid API key
+ANONYMOUS_REQUEST_CLASS = os.environ.get("ANONYMOUS_REQUEST_CLASS", "bulk")
+if ANONYMOUS_REQUEST_CLASS not in ("interactive", "bulk"):
+    raise ValueError("ANONYMOUS_REQUEST_CLASS must be 'interactive' or 'bulk'")
+# Concurrent extractions, and how many may wait for a slot
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "2"))
+EXTRACTION_QUEUE_LIMIT = int(os.environ.get("EXTRACTION_QUEUE_LIMIT", "1000"))
+# Scheduling weights: an interactive request is served WEIGHT times as
+# often as a bulk one when both are waiting
+INTERACTIVE_WEIGHT = float(os.environ.get("INTERACTIVE_WEIGHT", "8"))
+BULK_WEIGHT = float(os.environ.get("BULK_WEIGHT", "1"))
+MAX_TRACKED_CLIENTS = int(os.environ.get("MAX_TRACKED_CLIENTS", "10000"))
+
+
+def parse_client_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        key, limit = entry.split("=", 1)
+        per_minute, _, burst = limit.partition("/")
+        limits[key.strip()] = (float(per_minute), float(burst or RATE_LIMIT_BURST))
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientState:
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.bucket = bucket
+        self.admitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.request_class = "interactive"
+
+
+class AdmissionController:
+    """Per-client token buckets and metrics, kept for the most recent clients"""
+
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST,
+                 client_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 bulk_clients: Optional[Set[str]] = None, max_clients: int = MAX_TRACKED_CLIENTS,
+                 api_keys: Optional[Set[str]] = None, anonymous_class: str = ANONYMOUS_REQUEST_CLASS):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.client_limits = client_limits if client_limits is not None else parse_client_limits(CLIENT_RATE_LIMITS)
+        self.bulk_clients = bulk_clients if bulk_clients is not None else BULK_CLIENTS
+        self.api_keys = api_keys if api_keys is not None else API_KEYS
+        self.anonymous_class = anonymous_class
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, ClientState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def identify(self, request: Request) -> Tuple[str, str]:
+        """Client key (known API key, else IP) and request class for a request.
+
+        The class comes from the validated key; X-Request-Class can only
+        lower it to bulk.
+        """
+        api_key = request.headers.get("x-api-key")
+        if api_key and api_key in self.api_keys:
+            client = f"key:{api_key}"
+            request_class = "bulk" if api_key in self.bulk_clients else "interactive"
+        else:
+            client = f"ip:{request.client.host if request.client else 'unknown'}"
+            request_class = self.anonymous_class
+        if request.headers.get("x-request-class") == "bulk":
+            request_class = "bulk"
+        return client, request_class
+
+    def _state(self, client: str) -> ClientState:
+        state = self._clients.get(client)
+        if state is None:
+            per_minute, burst = self.client_limits.get(client.split(":", 1)[1], (self.per_minute, self.burst))
+            state = ClientState(TokenBucket(per_minute, burst) if per_minute > 0 else None)
+            self._clients[client] = state
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return state
+
+    def admit(self, client: str, request_class: str):
+        """Raise a 429 with Retry-After if the client is over its rate limit"""
+        with self._lock:
+            state = self._state(client)
+            state.request_class = request_class
+            retry_after = state.bucket.take() if state.bucket is not None else 0.0
+            if retry_after:
+                state.rejected += 1
+            else:
+                state.admitted += 1
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+    def record_wait(self, client: str, seconds: float, queued: bool):
+        with self._lock:
+            state = self._state(client)
+            state.wait_seconds += seconds
+            state.queued += int(queued)
+
+    def reject(self, client: str):
+        with self._lock:
+            self._state(client).rejected += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                client: {
+                    "class": state.request_class,
+                    "admitted": state.admitted,
+                    "rejected": state.rejected,
+                    "queued": state.queued,
+                    "avg_wait_ms": round(state.wait_seconds / state.admitted * 1000, 3) if state.admitted else 0.0,
+                    "tokens": round(state.bucket.tokens, 2) if state.bucket is not None else None
+                }
+                for client, state in self._clients.items()
+            }
+
+
+class QueueFull(Exception):
+    pass
+
+
+class FairScheduler:
+    """Weighted fair queue in front of the extraction stage.
+
+    Each waiting request gets a virtual finish tag of
+    max(virtual time, client's previous tag) + 1 / weight, and free slots go
+    to the smallest tag. A client cannot get ahead by queueing many
+    requests, and interactive requests (higher weight) overtake bulk ones.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, slots: int = EXTRACTION_CONCURRENCY, max_queue: int = EXTRACTION_QUEUE_LIMIT):
+        self.free = slots
+        self.max_queue = max_queue
+        self.virtual_time = 0.0
+        self.waiting = 0
+        self._heap = []
+        self._finish_tags: Dict[str, float] = {}
+        self._sequence = itertools.count()
+
+    async def acquire(self, client: str, weight: float) -> bool:
+        """Wait for a slot; returns True if the request had to queue"""
+        # release() hands slots to live waiters first, so a free slot means
+        # nobody is waiting
+        if self.free > 0:
+            self.free -= 1
+            return False
+        if self.waiting >= self.max_queue:
+            raise QueueFull()
+
+        finish = max(self.virtual_time, self._finish_tags.get(client, 0.0)) + 1 / weight
+        self._finish_tags[client] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._sequence), future))
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.waiting -= 1
+            else:
+                # Granted just as the waiter went away: hand the slot on
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        while self._heap:
+            finish, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self.waiting -= 1
+            self.virtual_time = max(self.virtual_time, finish)
+            future.set_result(None)
+            self._prune()
+            return
+        self.free += 1
+
+    def _prune(self):
+        if len(self._finish_tags) > MAX_TRACKED_CLIENTS:
+            self._finish_tags = {
+                client: tag for client, tag in self._finish_tags.items() if tag > self.virtual_time
+            }
+
+
+admission = AdmissionController()
+scheduler = FairScheduler()
+
+
+@asynccontextmanager
+async def extraction_slot(client: str, request_class: str):
+    """Hold one extraction slot, granted in weighted fair order"""
+    weight = BULK_WEIGHT if request_class == "bulk" else INTERACTIVE_WEIGHT
+    start = time.perf_counter()
+    try:
+        queued = await scheduler.acquire(client, weight)
+    except QueueFull:
+        admission.reject(client)
+        raise HTTPException(status_code=429, detail="Extraction queue is full", headers={"Retry-After": "1"})
+    admission.record_wait(client, time.perf_counter() - start, queued)
+    try:
+        yield
+    finally:
+        scheduler.release()
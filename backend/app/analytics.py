@@ -0,0 +1,338 @@
+import calendar
+import datetime
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+
+from .models import Report, ReportChange
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ANALYTICS_STORE_ENABLED = os.environ.get("ANALYTICS_STORE_ENABLED", "").lower() in ("1", "true", "yes")
+# How often a query first pulls in changes made by other worker processes
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get("ANALYTICS_REFRESH_SECONDS", "5"))
+
+GROUP_BY_FIELDS = ("drug", "severity", "outcome", "adverse_event")
+
+
+def to_epoch(value: Optional[datetime.datetime]) -> int:
+    """Seconds since the epoch for a naive UTC datetime"""
+    if value is None:
+        return 0
+    return calendar.timegm(value.utctimetuple())
+
+
+class Column:
+    """Append-only NumPy array with amortized doubling"""
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self._grow(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        if self.size + len(values) > len(self.data):
+            self._grow(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def _grow(self, needed: int):
+        capacity = max(needed, len(self.data) * 2)
+        data = np.zeros(capacity, dtype=self.data.dtype)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+    def view(self, size: int):
+        return self.data[:size]
+
+
+class Bitmap:
+    """Packed bitmap with one bit per row"""
+
+    def __init__(self, capacity: int = 1024):
+        self.bits = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+
+    def _reserve(self, nbytes: int):
+        if nbytes > len(self.bits):
+            bits = np.zeros(max(nbytes, len(self.bits) * 2), dtype=np.uint8)
+            bits[:len(self.bits)] = self.bits
+            self.bits = bits
+
+    def set(self, row: int):
+        self._reserve((row >> 3) + 1)
+        # Most significant bit first, the order np.unpackbits uses
+        self.bits[row >> 3] |= np.uint8(0x80 >> (row & 7))
+
+    def set_many(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        self._reserve(int(rows.max() >> 3) + 1)
+        np.bitwise_or.at(self.bits, rows >> 3, (0x80 >> (rows & 7)).astype(np.uint8))
+
+    def mask(self, size: int):
+        nbytes = (size + 7) // 8
+        packed = self.bits[:nbytes]
+        if len(packed) < nbytes:
+            packed = np.concatenate([packed, np.zeros(nbytes - len(packed), dtype=np.uint8)])
+        return np.unpackbits(packed, count=size).astype(bool)
+
+
+class Dictionary:
+    """Maps a low-cardinality string column to small integer codes"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class AnalyticsStore:
+    """In-process columnar snapshot of report metadata.
+
+    Each report is one row across array-backed columns. drug, severity and
+    outcome are dictionary-encoded to integer codes and every adverse event
+    has its own packed bitmap, so filters and group-bys are vectorized
+    NumPy operations over the whole table.
+
+    Rows are never changed in place. refresh() follows the report change
+    log: an updated report's old row is marked dead and its current state
+    appended, a deleted report's row is marked dead. Once half the rows are
+    dead the columns are compacted.
+    """
+
+    # Dead rows tolerated before compaction is considered
+    compact_min_dead = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ids = Column(np.int64)
+        self.created_at = Column(np.int64)
+        self.drug = Column(np.int32)
+        self.severity = Column(np.uint8)
+        self.outcome = Column(np.uint8)
+        self.drugs = Dictionary()
+        self.severities = Dictionary()
+        self.outcomes = Dictionary()
+        self.events: Dict[str, Bitmap] = {}
+        self.dead = Bitmap()
+        self.dead_count = 0
+        self.size = 0
+        # Changes made by other processes are pulled in by refresh(); inserts
+        # this process appended itself are skipped then.
+        self._cursor: Optional[int] = None
+        self._local_ids = set()
+        # Reports the last refresh read from the database
+        self._refreshed_ids = set()
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def _append_row(self, report_id: int, drug: str, severity: str, outcome: str,
+                    adverse_events: Iterable[str], created_at: Optional[datetime.datetime]):
+        row = self.size
+        self.ids.append(report_id)
+        self.created_at.append(to_epoch(created_at))
+        self.drug.append(self.drugs.encode(drug))
+        self.severity.append(self.severities.encode(severity))
+        self.outcome.append(self.outcomes.encode(outcome))
+        for event in adverse_events:
+            bitmap = self.events.get(event)
+            if bitmap is None:
+                bitmap = self.events[event] = Bitmap(len(self.ids.data))
+            bitmap.set(row)
+        self.size += 1
+
+    def _extend_rows(self, rows):
+        """Bulk version of _append_row for (id, drug, severity, outcome, events, created_at) rows"""
+        if not rows:
+            return
+        start = self.size
+        event_rows: Dict[str, List[int]] = {}
+        for offset, row in enumerate(rows):
+            for event in row[4].split(","):
+                event_rows.setdefault(event, []).append(start + offset)
+
+        self.ids.extend([row[0] for row in rows])
+        self.drug.extend([self.drugs.encode(row[1]) for row in rows])
+        self.severity.extend([self.severities.encode(row[2]) for row in rows])
+        self.outcome.extend([self.outcomes.encode(row[3]) for row in rows])
+        self.created_at.extend([to_epoch(row[5]) for row in rows])
+        for event, event_row_numbers in event_rows.items():
+            bitmap = self.events.get(event)
+            if bitmap is None:
+                bitmap = self.events[event] = Bitmap(len(self.ids.data))
+            bitmap.set_many(event_row_numbers)
+        self.size += len(rows)
+
+    def append(self, report_id: int, drug: str, severity: str, outcome: str,
+               adverse_events: Iterable[str], created_at: Optional[datetime.datetime] = None):
+        """Add a report that was just inserted by this process"""
+        with self._lock:
+            # A refresh between the commit and this call already added it
+            if report_id in self._refreshed_ids:
+                return
+            self._append_row(report_id, drug, severity, outcome, adverse_events,
+                             created_at or datetime.datetime.utcnow())
+            self._local_ids.add(report_id)
+
+    def refresh(self, db, force: bool = False):
+        """Apply report changes not seen yet: load every report on the first call"""
+        if not force and time.monotonic() - self._refreshed_at < ANALYTICS_REFRESH_SECONDS:
+            return
+        # A refresh already running in another thread covers this one
+        if not self._refresh_lock.acquire(blocking=force):
+            return
+        try:
+            if self._cursor is None:
+                self._load(db)
+            else:
+                self._apply_changes(db)
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _select(self, db):
+        return db.query(Report.id, Report.drug, Report.severity, Report.outcome,
+                        Report.adverse_events, Report.created_at)
+
+    def _load(self, db):
+        # Read the cursor first: a change made meanwhile is applied again by
+        # the next refresh, which is harmless
+        cursor = db.query(func.max(ReportChange.seq)).scalar() or 0
+        rows = self._select(db).order_by(Report.id).all()
+        with self._lock:
+            loaded = {row[0] for row in rows}
+            self._extend_rows(rows)
+            # Reports this process appended before the load are in it now
+            self._kill(np.fromiter(self._local_ids & loaded, dtype=np.int64), self.size - len(rows))
+            self._local_ids -= loaded
+            self._cursor = cursor
+
+    def _apply_changes(self, db):
+        changes = (
+            db.query(ReportChange.seq, ReportChange.report_id, ReportChange.op)
+            .filter(ReportChange.seq > self._cursor)
+            .order_by(ReportChange.seq)
+            .all()
+        )
+        if not changes:
+            return
+        changed = {}
+        for _, report_id, op in changes:
+            # Only the current state of a report matters
+            changed[report_id] = changed.get(report_id, set()) | {op}
+        with self._lock:
+            # Inserts appended by this process are already in the store
+            own = {report_id for report_id, ops in changed.items()
+                   if ops == {"insert"} and report_id in self._local_ids}
+            self._local_ids -= set(changed)
+        stale = [report_id for report_id in changed if report_id not in own]
+
+        rows = []
+        for start in range(0, len(stale), 500):
+            rows.extend(self._select(db).filter(Report.id.in_(stale[start:start + 500])).all())
+        rows.sort(key=lambda row: row[0])
+        with self._lock:
+            self._kill(np.asarray(stale, dtype=np.int64), self.size)
+            self._extend_rows(rows)
+            self._refreshed_ids = {row[0] for row in rows}
+            self._cursor = changes[-1][0]
+            if self.dead_count > self.compact_min_dead and self.dead_count * 2 > self.size:
+                self._compact()
+
+    def _kill(self, report_ids, size: int):
+        """Mark the live rows of these reports among the first size rows dead"""
+        if not len(report_ids) or not size:
+            return
+        rows = np.nonzero(np.isin(self.ids.view(size), report_ids) & ~self.dead.mask(size))[0]
+        self.dead.set_many(rows)
+        self.dead_count += len(rows)
+
+    def _compact(self):
+        """Drop dead rows from every column and bitmap"""
+        keep = ~self.dead.mask(self.size)
+        for column in (self.ids, self.created_at, self.drug, self.severity, self.outcome):
+            live = column.view(self.size)[keep]
+            column.data = np.zeros(max(len(live), 1024), dtype=column.data.dtype)
+            column.data[:len(live)] = live
+            column.size = len(live)
+        for event, bitmap in list(self.events.items()):
+            rows = np.nonzero(bitmap.mask(self.size)[keep])[0]
+            compacted = Bitmap(len(self.ids.data))
+            compacted.set_many(rows)
+            self.events[event] = compacted
+        self.size = int(np.count_nonzero(keep))
+        self.dead = Bitmap(len(self.ids.data))
+        self.dead_count = 0
+        print(f"[INFO] Analytics store compacted to {self.size} reports")
+
+    def _match(self, dictionary: Dictionary, column: Column, value: str, size: int):
+        code = dictionary.codes.get(value)
+        if code is None:
+            return np.zeros(size, dtype=bool)
+        return column.view(size) == code
+
+    def query(self, drug: Optional[str] = None, severity: Optional[str] = None,
+              outcome: Optional[str] = None, adverse_event: Optional[str] = None,
+              since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+              group_by: Optional[str] = None) -> Dict:
+        """Count reports matching every given filter, optionally grouped"""
+        with self._lock:
+            size = self.size
+            mask = ~self.dead.mask(size) if self.dead_count else np.ones(size, dtype=bool)
+            if drug is not None:
+                mask &= self._match(self.drugs, self.drug, drug, size)
+            if severity is not None:
+                mask &= self._match(self.severities, self.severity, severity, size)
+            if outcome is not None:
+                mask &= self._match(self.outcomes, self.outcome, outcome, size)
+            if adverse_event is not None:
+                bitmap = self.events.get(adverse_event)
+                mask &= bitmap.mask(size) if bitmap is not None else np.zeros(size, dtype=bool)
+            if since is not None:
+                mask &= self.created_at.view(size) >= to_epoch(since)
+            if until is not None:
+                mask &= self.created_at.view(size) < to_epoch(until)
+
+            result = {"count": int(np.count_nonzero(mask))}
+            if group_by == "adverse_event":
+                groups = {event: int(np.count_nonzero(bitmap.mask(size) & mask))
+                          for event, bitmap in self.events.items()}
+            elif group_by is not None:
+                dictionary, column = {
+                    "drug": (self.drugs, self.drug),
+                    "severity": (self.severities, self.severity),
+                    "outcome": (self.outcomes, self.outcome),
+                }[group_by]
+                counts = np.bincount(column.view(size)[mask], minlength=len(dictionary.values))
+                groups = {value: int(counts[code]) for code, value in enumerate(dictionary.values)}
+            if group_by is not None:
+                result["groups"] = {value: count for value, count in groups.items() if count}
+            return result
+
+    def memory_bytes(self) -> int:
+        columns = (self.ids, self.created_at, self.drug, self.severity, self.outcome)
+        bitmaps = list(self.events.values()) + [self.dead]
+        return sum(column.data.nbytes for column in columns) + sum(b.bits.nbytes for b in bitmaps)
+
+
+analytics_store = AnalyticsStore() if ANALYTICS_STORE_ENABLED and np is not None else None
@@ -0,0 +1,201 @@
+"""Time-based archival of old reports into monthly databases.
+
+    python -m app.archive --older-than-days 365 [--batch-size 500]
+                          [--tenant <id> | --all-tenants]
+
+Reports created before the cutoff are moved, with their compressed
+narratives, into archive/reports_YYYY_MM.db (one SQLite file per month of
+created_at) and deleted from the hot database. A tenant's reports go to
+archive/<tenant>/reports_YYYY_MM.db instead. Archives use the same schema
+and stay queryable through /archive.
+"""
+import argparse
+import datetime
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, selectinload, sessionmaker
+
+from .database import Base
+from .models import NarrativeDictionary, Report, ReportNarrative
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "./archive")
+ARCHIVE_MAX_AGE_DAYS = int(os.environ.get("ARCHIVE_MAX_AGE_DAYS", "365"))
+
+MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+_sessionmakers: Dict[Tuple[Optional[str], str], sessionmaker] = {}
+_lock = threading.Lock()
+
+
+def archive_dir(tenant: Optional[str] = None) -> str:
+    return ARCHIVE_DIR if tenant is None else os.path.join(ARCHIVE_DIR, tenant)
+
+
+def archive_path(month: str, tenant: Optional[str] = None) -> str:
+    return os.path.join(archive_dir(tenant), f"reports_{month.replace('-', '_')}.db")
+
+
+def list_months(tenant: Optional[str] = None) -> List[str]:
+    """Months with an archive database, oldest first"""
+    directory = archive_dir(tenant)
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in os.listdir(directory):
+        match = re.match(r"^reports_(\d{4})_(\d{2})\.db$", name)
+        if match:
+            months.append(f"{match.group(1)}-{match.group(2)}")
+    return sorted(months)
+
+
+def archive_session(month: str, create: bool = False, tenant: Optional[str] = None) -> Session:
+    """Session on the archive database for a YYYY-MM month of a tenant
+    (None: the default database)"""
+    if not MONTH_PATTERN.match(month):
+        raise ValueError("Month must be formatted YYYY-MM")
+    path = archive_path(month, tenant)
+    with _lock:
+        factory = _sessionmakers.get((tenant, month))
+        if factory is None:
+            if not create and not os.path.exists(path):
+                raise FileNotFoundError(path)
+            os.makedirs(archive_dir(tenant), exist_ok=True)
+            engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+            Base.metadata.create_all(bind=engine)
+            # Narrative dictionaries are copied from the tenant's shard with
+            # their ids, so the codec caches them under the same shard key
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=engine,
+                                   info={"shard": tenant, "archive": True})
+            _sessionmakers[(tenant, month)] = factory
+    return factory()
+
+
+def _copy_report(report: Report) -> Report:
+    copy = Report(
+        id=report.id,
+        report_text=report.report_text,
+        drug=report.drug,
+        adverse_events=report.adverse_events,
+        severity=report.severity,
+        outcome=report.outcome,
+        created_at=report.created_at,
+        extraction_version=report.extraction_version,
+        language=report.language,
+    )
+    if report.narrative is not None:
+        copy.narrative = ReportNarrative(
+            codec=report.narrative.codec,
+            dictionary_id=report.narrative.dictionary_id,
+            body=report.narrative.body,
+        )
+    return copy
+
+
+def _copy_dictionaries(db: Session, archive: Session, reports: List[Report]):
+    """Make sure the archive holds every dictionary its narratives need"""
+    needed = {r.narrative.dictionary_id for r in reports if r.narrative is not None and r.narrative.dictionary_id}
+    for dictionary_id in needed:
+        if archive.get(NarrativeDictionary, dictionary_id) is None:
+            dictionary = db.get(NarrativeDictionary, dictionary_id)
+            archive.add(NarrativeDictionary(
+                id=dictionary.id,
+                data=dictionary.data,
+                sample_count=dictionary.sample_count,
+                created_at=dictionary.created_at,
+            ))
+
+
+def archive_reports(db: Session, cutoff: datetime.datetime, batch_size: int = 500) -> int:
+    """Move reports created before cutoff into the monthly archives of the
+    session's shard"""
+    tenant = db.info.get("shard")
+    moved = 0
+    while True:
+        reports = (
+            db.query(Report)
+            .options(selectinload(Report.narrative))
+            .filter(Report.created_at < cutoff)
+            .order_by(Report.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not reports:
+            return moved
+
+        by_month: Dict[str, List[Report]] = {}
+        for report in reports:
+            by_month.setdefault(report.created_at.strftime("%Y-%m"), []).append(report)
+
+        # Write the archives first; merge() makes a rerun after a crash
+        # between the two commits overwrite rather than duplicate rows.
+        for month, month_reports in by_month.items():
+            archive = archive_session(month, create=True, tenant=tenant)
+            try:
+                _copy_dictionaries(db, archive, month_reports)
+                for report in month_reports:
+                    archive.merge(_copy_report(report))
+                archive.commit()
+            finally:
+                archive.close()
+
+        for report in reports:
+            db.delete(report)
+        db.commit()
+        moved += len(reports)
+        print(f"[INFO] Archived {moved} reports")
+
+
+def count_reports(month: str, tenant: Optional[str] = None) -> int:
+    archive = archive_session(month, tenant=tenant)
+    try:
+        return archive.query(func.count(Report.id)).scalar()
+    finally:
+        archive.close()
+
+
+def main():
+    from .database import init_db
+    from .tenants import router, validate_tenant
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_MAX_AGE_DAYS)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true", help="reclaim the freed space afterwards")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--tenant", help="archive one tenant's shard instead of the default database")
+    scope.add_argument("--all-tenants", action="store_true", help="archive the default database and every tenant shard")
+    args = parser.parse_args()
+
+    if args.all_tenants:
+        tenants = [None] + router.tenants()
+    elif args.tenant:
+        try:
+            tenants = [validate_tenant(args.tenant)]
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        tenants = [None]
+
+    init_db()
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=args.older_than_days)
+    for tenant in tenants:
+        db = router.session(tenant)
+        try:
+            moved = archive_reports(db, cutoff, args.batch_size)
+        finally:
+            db.close()
+        print(f"[INFO] Done: {moved} reports created before {cutoff:%Y-%m-%d} archived to {archive_dir(tenant)}")
+
+        if args.vacuum:
+            engine = db.get_bind()
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
+            print("[INFO] Database vacuumed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, Dict, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import Report, ReportChange
+from .serialization import encode_response
+
+# How long a rendered response is served from memory without re-checking the
+# database. Writes made by this process invalidate the cache immediately; the
+# TTL only bounds staleness for writes made by other processes.
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "2.0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+
+
+class ResponseCache:
+    """Short-lived cache of rendered responses keyed by request shape.
+
+    Entries are tagged with the write version they were rendered at, so a
+    bump of the version makes every older entry stale at once.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self._entries: Dict[Tuple, Tuple[float, int, Dict[str, str], Response]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple):
+        """Return (validators, response) for a fresh entry, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, version, validators, response = entry
+            if version != self.version or expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return validators, response
+
+    def put(self, key: Tuple, version: int, validators: Dict[str, str], response: Response):
+        """Store a response rendered from data read at the given version"""
+        with self._lock:
+            if version != self.version:
+                return
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, version, validators, response)
+
+    def invalidate(self):
+        """Bump the write version and drop every cached response"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def invalidate():
+    """Call after any write to the reports table"""
+    response_cache.invalidate()
+
+
+def compute_validators(db: Session) -> Dict[str, str]:
+    """Build ETag/Last-Modified headers from the current state of the reports table"""
+    max_id, count = db.query(func.max(Report.id), func.count(Report.id)).one()
+    # The change log moves on inserts, updates and deletes alike, so its
+    # newest entry is both part of the ETag and the Last-Modified time
+    max_seq, last_change = db.query(func.max(ReportChange.seq), func.max(ReportChange.created_at)).one()
+    if last_change is None:
+        # Reports written before the change log existed
+        last_change = db.query(func.max(Report.created_at)).scalar()
+    fingerprint = f"{max_id}:{count}:{max_seq}:{last_change}"
+    validators = {"ETag": '"' + hashlib.md5(fingerprint.encode("utf-8")).hexdigest() + '"'}
+    if last_change is not None:
+        # Timestamps are stored as naive UTC. Last-Modified has one-second
+        # resolution, so clients should prefer If-None-Match.
+        last_modified = last_change.replace(microsecond=0, tzinfo=timezone.utc)
+        validators["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return validators
+
+
+def is_not_modified(request: Request, validators: Dict[str, str]) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the current validators"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")]
+        return "*" in tags or validators["ETag"] in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = validators.get("Last-Modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(validators: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=validators)
+
+
+def cached_response(request: Request, db: Session, build: Callable[[], Any]) -> Response:
+    """Serve a read endpoint with conditional GET and the response cache.
+
+    build() is only called when neither the client nor the cache holds a
+    representation of the current data.
+    """
+    key = (
+        request.url.path,
+        request.url.query,
+        request.headers.get("x-tenant-id", ""),
+        request.headers.get("accept", ""),
+        request.headers.get("accept-encoding", ""),
+    )
+
+    cached = response_cache.get(key)
+    if cached is not None:
+        validators, response = cached
+        if is_not_modified(request, validators):
+            return not_modified_response(validators)
+        return response
+
+    version = response_cache.version
+    validators = compute_validators(db)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+
+    response = encode_response(request, build())
+    response.headers.update(validators)
+    response.headers["Cache-Control"] = "no-cache"
+    response_cache.put(key, version, validators, response)
+    return response
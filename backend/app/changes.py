@@ -0,0 +1,85 @@
+import datetime
+import os
+from typing import Callable, Dict, Iterable
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, selectinload
+
+from .models import Report, ReportChange
+
+# Changes returned per /reports/changes page, by default and at most
+CHANGES_PAGE_SIZE = int(os.environ.get("CHANGES_PAGE_SIZE", "500"))
+CHANGES_MAX_PAGE_SIZE = int(os.environ.get("CHANGES_MAX_PAGE_SIZE", "5000"))
+
+
+def record_changes(db: Session, report_ids: Iterable[int], op: str):
+    """Append change_log rows in the session's transaction"""
+    now = datetime.datetime.utcnow()
+    rows = [{"report_id": report_id, "op": op, "created_at": now} for report_id in report_ids]
+    if rows:
+        db.connection().execute(insert(ReportChange), rows)
+
+
+# Every ORM write to a report (API, group-commit writer, archival, narrative
+# compression) is logged in the same transaction, with one multi-row insert
+# per flush. Bulk operations bypass the session and must call
+# record_changes() themselves. Rows copied into monthly archive databases
+# are not changes to the live reports, so archive sessions are skipped.
+@event.listens_for(Session, "after_flush")
+def _log_report_changes(session, flush_context):
+    if session.info.get("archive"):
+        return
+    ops = (
+        ("insert", session.new),
+        ("update", [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]),
+        ("delete", session.deleted),
+    )
+    rows = []
+    now = datetime.datetime.utcnow()
+    for op, objects in ops:
+        rows.extend({"report_id": obj.id, "op": op, "created_at": now} for obj in objects if isinstance(obj, Report))
+    if rows:
+        session.connection().execute(insert(ReportChange), rows)
+
+
+def changes_since(db: Session, since: int, limit: int, serialize: Callable[[Session, Report], Dict]) -> Dict:
+    """One page of changes after the since cursor.
+
+    Several changes to one report within the page are collapsed into its
+    latest state: the current row, or a delete if it no longer exists.
+
+    The cursor relies on SQLite running one write transaction at a time, so
+    sequence numbers become visible in order. On a database with concurrent
+    writers (e.g. Postgres tenant schemas) a transaction can commit a lower
+    seq after a reader has moved past it, and that change would be missed.
+    """
+    rows = (
+        db.query(ReportChange.seq, ReportChange.report_id)
+        .filter(ReportChange.seq > since)
+        .order_by(ReportChange.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest: Dict[int, int] = {}
+    for seq, report_id in rows:
+        latest[report_id] = seq
+    reports = {
+        report.id: report
+        for report in db.query(Report).options(selectinload(Report.narrative)).filter(Report.id.in_(list(latest)))
+    }
+
+    changes = []
+    for report_id, seq in sorted(latest.items(), key=lambda item: item[1]):
+        report = reports.get(report_id)
+        if report is None:
+            changes.append({"seq": seq, "op": "delete", "id": report_id})
+        else:
+            changes.append({"seq": seq, "op": "upsert", "id": report_id, "report": serialize(db, report)})
+    return {
+        "changes": changes,
+        "next_cursor": rows[-1][0] if rows else since,
+        "has_more": has_more,
+    }
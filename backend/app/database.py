@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -10,4 +10,56 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+_initialized = False
+
+
+def init_db():
+    """Create database tables once per process tree.
+
+    The production launcher calls this in the parent before forking workers,
+    so the flag is already set when each worker runs the app startup hook.
+    """
+    global _initialized
+    if _initialized:
+        return
+    create_schema(engine)
+    print("[INFO] Database tables created (or already exist). If you see 'no such table' errors, delete reports.db and restart.")
+    _initialized = True
+
+
+def create_schema(bind, schema=None):
+    """Create missing tables, columns and indexes on one database or schema"""
+    # Import models so they are registered on Base.metadata, and the
+    # change log listeners so every writer records its changes
+    from . import changes, models  # noqa: F401
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind, schema)
+
+
+def add_missing_columns(bind, schema=None):
+    """Add columns that exist on the models but not yet in the database.
+
+    create_all() only creates missing tables, so columns added to a model
+    later never reach an existing reports.db. New columns must be nullable
+    or have a server default for this to work. Missing indexes are created
+    as well. schema names the Postgres schema a tenant shard lives in.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name, schema=schema):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name, schema=schema)}
+            table_name = f'"{schema}".{table.name}' if schema else table.name
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"))
+                print(f"[INFO] Added column {table_name}.{column.name}")
+            # Indexes declared on existing columns after the table was created
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,104 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .models import Document, Entity
+
+# processed_data field holding each entity type
+ENTITY_FIELDS = {
+    "diagnosis": "diagnoses",
+    "medication": "medications",
+    "symptom": "symptoms",
+    "procedure": "procedures",
+}
+
+ALLOWED_CONTENT_TYPES = (
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/msword",
+    "text/plain",
+)
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_entity(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip().lower()[:255]
+
+
+def store_document(db: Session, filename: str, content_type: str, text: str,
+                   processed_data: Dict[str, Any]) -> Document:
+    """Save a document with the entity spans found in it"""
+    document = Document(
+        filename=filename,
+        content_type=content_type,
+        text=text,
+        text_hash=processed_data["text_hash"],
+    )
+    for entity_type, field in ENTITY_FIELDS.items():
+        for span in processed_data.get(field, []):
+            document.entities.append(Entity(
+                entity_type=entity_type,
+                text=span["text"],
+                normalized_text=normalize_entity(span["text"]),
+                start_pos=span["start_pos"],
+                end_pos=span["end_pos"],
+                confidence=span["confidence"],
+            ))
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+    return document
+
+
+def search_entities(db: Session, entity_type: str, text: str, limit: int = 100, offset: int = 0) -> List[Dict]:
+    """Documents with an entity of the given type and text, newest first.
+
+    Served from the (entity_type, normalized_text) index; the extractors are
+    not run again.
+    """
+    match = (Entity.entity_type == entity_type, Entity.normalized_text == normalize_entity(text))
+    document_ids = [
+        document_id for (document_id,) in
+        db.query(Entity.document_id).filter(*match)
+        .distinct().order_by(Entity.document_id.desc()).limit(limit).offset(offset)
+    ]
+    spans: Dict[int, List[Dict]] = {document_id: [] for document_id in document_ids}
+    for document_id, span_text, start_pos, end_pos in (
+        db.query(Entity.document_id, Entity.text, Entity.start_pos, Entity.end_pos)
+        .filter(*match, Entity.document_id.in_(document_ids))
+        .order_by(Entity.start_pos)
+    ):
+        spans[document_id].append({"text": span_text, "start_pos": start_pos, "end_pos": end_pos})
+
+    documents = db.query(Document.id, Document.filename, Document.created_at).filter(Document.id.in_(document_ids))
+    by_id = {document.id: document for document in documents}
+    return [
+        {
+            "id": document_id,
+            "filename": by_id[document_id].filename,
+            "created_at": by_id[document_id].created_at.isoformat(),
+            "matches": spans[document_id],
+        }
+        for document_id in document_ids
+    ]
+
+
+def document_entities(db: Session, document_id: int, entity_type: Optional[str] = None) -> Optional[List[Dict]]:
+    """Entity spans of one document in text order, or None if it does not exist"""
+    if db.get(Document, document_id) is None:
+        return None
+    query = db.query(Entity).filter(Entity.document_id == document_id)
+    if entity_type is not None:
+        query = query.filter(Entity.entity_type == entity_type)
+    return [
+        {
+            "type": entity.entity_type,
+            "text": entity.text,
+            "start_pos": entity.start_pos,
+            "end_pos": entity.end_pos,
+            "confidence": entity.confidence,
+        }
+        for entity in query.order_by(Entity.start_pos)
+    ]
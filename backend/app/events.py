@@ -0,0 +1,242 @@
+import asyncio
+import os
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+
+from .models import Report, ReportChange
+from .serialization import dumps_json
+
+# Frames buffered per client before it is considered too slow and dropped
+STREAM_CLIENT_BUFFER = int(os.environ.get("STREAM_CLIENT_BUFFER", "100"))
+# Seconds between keepalive comments on an idle stream
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", "15"))
+# Recent reports kept per tenant for clients reconnecting with Last-Event-ID
+STREAM_REPLAY_EVENTS = int(os.environ.get("STREAM_REPLAY_EVENTS", "1000"))
+# Seconds between change log polls, and change log rows read per poll
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", "0.5"))
+STREAM_POLL_BATCH = int(os.environ.get("STREAM_POLL_BATCH", "500"))
+
+
+class Subscriber:
+    """One connected stream client with a bounded frame buffer"""
+
+    def __init__(self, deltas: bool, buffer_size: int, tenant: Optional[str] = None):
+        self.deltas = deltas
+        self.tenant = tenant
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+    def offer(self, frame: bytes) -> bool:
+        """Queue a frame without waiting; False if the client fell behind"""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop(self):
+        """Discard the backlog and tell the stream to close"""
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Broadcaster:
+    """In-process fan-out of newly processed reports to stream clients.
+
+    Every event is serialized once and pushed into each subscriber's
+    bounded queue, so idle clients cost one waiting coroutine and no
+    database access. A client whose queue is full is disconnected rather
+    than slowing down the others. Must be used from the event loop thread.
+
+    The last replay_size reports of each tenant are kept, so a client
+    reconnecting with Last-Event-ID gets what it missed. If that event is
+    no longer buffered, the client is sent a `resync` event and should
+    reload through /reports/changes instead.
+    """
+
+    def __init__(self, buffer_size: int = STREAM_CLIENT_BUFFER, replay_size: int = STREAM_REPLAY_EVENTS):
+        self.buffer_size = buffer_size
+        self.replay_size = replay_size
+        self.subscribers: Set[Subscriber] = set()
+        self.dropped_total = 0
+        self._history: Dict[Optional[str], Deque[Tuple[int, bytes, Dict]]] = {}
+
+    def subscribe(self, deltas: bool = False, tenant: Optional[str] = None,
+                  last_event_id: Optional[int] = None) -> Subscriber:
+        """Subscribe to the reports of one tenant (the default database if None),
+        replaying those published after last_event_id"""
+        subscriber = Subscriber(deltas, self.buffer_size, tenant)
+        if last_event_id is not None:
+            self._replay(subscriber, last_event_id)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def _replay(self, subscriber: Subscriber, last_event_id: int):
+        # Publish order, not id order: ids of concurrent requests can be
+        # published out of order
+        history = list(self._history.get(subscriber.tenant, ()))
+        position = next((i for i, (report_id, _, _) in enumerate(history) if report_id == last_event_id), None)
+        missed = history[position + 1:] if position is not None else None
+        frames_per_event = 2 if subscriber.deltas else 1
+        if missed is None or len(missed) * frames_per_event >= self.buffer_size:
+            subscriber.offer(format_event("resync", {"last_event_id": last_event_id}))
+            return
+        for _, report_frame, report in missed:
+            subscriber.offer(report_frame)
+            if subscriber.deltas:
+                subscriber.offer(format_event("stats", stats_delta(report)))
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, report: Dict, tenant: Optional[str] = None):
+        """Push a report summary (and its stats delta) to the tenant's subscribers"""
+        report_frame = format_event("report", report, event_id=report["id"])
+        history = self._history.get(tenant)
+        if history is None:
+            history = self._history[tenant] = deque(maxlen=self.replay_size)
+        history.append((report["id"], report_frame, report))
+
+        subscribers = [subscriber for subscriber in self.subscribers if subscriber.tenant == tenant]
+        if not subscribers:
+            return
+        delta_frame = None
+        if any(subscriber.deltas for subscriber in subscribers):
+            delta_frame = format_event("stats", stats_delta(report))
+
+        for subscriber in subscribers:
+            delivered = subscriber.offer(report_frame)
+            if delivered and subscriber.deltas:
+                delivered = subscriber.offer(delta_frame)
+            if not delivered:
+                subscriber.drop()
+                self.unsubscribe(subscriber)
+                self.dropped_total += 1
+
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """Server-sent event frames for one client, until it disconnects or is dropped"""
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+
+class ChangeLogTailer:
+    """Feeds a broadcaster with the reports inserted by every process.
+
+    Each worker runs one task that polls the change log of every database
+    its clients follow and publishes the newly inserted reports, so a
+    stream sees reports processed by the other workers (and by other
+    processes) too. Clients never query the database themselves.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, session_for: Callable[[Optional[str]], Session],
+                 serialize: Callable[[Session, Report], Dict],
+                 interval: float = STREAM_POLL_SECONDS, batch_size: int = STREAM_POLL_BATCH):
+        self.broadcaster = broadcaster
+        self.session_for = session_for
+        self.serialize = serialize
+        self.interval = interval
+        self.batch_size = batch_size
+        # Last change log seq read, per followed database (None: default)
+        self._cursors: Dict[Optional[str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.watch(None)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def watch(self, tenant: Optional[str]):
+        """Follow a tenant's change log from now on (idempotent)"""
+        if tenant not in self._cursors:
+            seq = await asyncio.get_running_loop().run_in_executor(None, self._latest_seq, tenant)
+            self._cursors.setdefault(tenant, seq)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            for tenant in list(self._cursors):
+                try:
+                    reports = await loop.run_in_executor(None, self._poll, tenant)
+                except Exception as e:
+                    print(f"[WARNING] Could not read the change log of {tenant or 'the default database'}: {e}")
+                    continue
+                for report in reports:
+                    self.broadcaster.publish(report, tenant)
+
+    def _latest_seq(self, tenant: Optional[str]) -> int:
+        db = self.session_for(tenant)
+        try:
+            return db.query(func.max(ReportChange.seq)).scalar() or 0
+        finally:
+            db.close()
+
+    def _poll(self, tenant: Optional[str]) -> List[Dict]:
+        """Reports inserted since the last poll, in commit order"""
+        db = self.session_for(tenant)
+        try:
+            rows = (
+                db.query(ReportChange.seq, ReportChange.report_id, ReportChange.op)
+                .filter(ReportChange.seq > self._cursors[tenant])
+                .order_by(ReportChange.seq)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                return []
+            self._cursors[tenant] = rows[-1][0]
+            inserted = [report_id for _, report_id, op in rows if op == "insert"]
+            reports = {
+                report.id: report
+                for report in db.query(Report).options(selectinload(Report.narrative)).filter(Report.id.in_(inserted))
+            }
+            # Reports deleted again since (e.g. archived) are skipped
+            return [self.serialize(db, reports[report_id]) for report_id in inserted if report_id in reports]
+        finally:
+            db.close()
+
+
+def format_event(event: str, data: Dict, event_id: Optional[int] = None) -> bytes:
+    frame = f"event: {event}\n".encode("utf-8")
+    if event_id is not None:
+        frame += f"id: {event_id}\n".encode("utf-8")
+    return frame + b"data: " + dumps_json(data) + b"\n\n"
+
+
+def stats_delta(report: Dict) -> Dict:
+    """Change to the /stats aggregates caused by one new report"""
+    return {
+        "total_reports": 1,
+        "by_severity": {report["severity"]: 1},
+        "by_outcome": {report["outcome"]: 1},
+        "by_drug": {report["drug"]: 1},
+        "by_adverse_event": {event: 1 for event in report["adverse_events"]},
+    }
+
+
+broadcaster = Broadcaster()
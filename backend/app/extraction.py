@@ -0,0 +1,408 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .language import SUPPORTED_LANGUAGES, detect_language
+
+# Version of the extraction rules. Bump it whenever a change to the patterns,
+# keyword tables or classifiers below should be applied to stored reports,
+# then run `python -m app.reprocess`.
+EXTRACTION_VERSION = 2
+
+# Extraction strategies:
+# - rules-only: precompiled keyword/regex pass, spaCy is never called
+# - ner-only:   spaCy NER with the keyword pass as a fallback (original behaviour)
+# - cascade:    keyword pass first, spaCy only when it is not confident enough
+STRATEGIES = ("rules-only", "ner-only", "cascade")
+EXTRACTION_STRATEGY = os.environ.get("EXTRACTION_STRATEGY", "ner-only")
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", "0.75"))
+
+if EXTRACTION_STRATEGY not in STRATEGIES:
+    raise ValueError(f"EXTRACTION_STRATEGY must be one of {', '.join(STRATEGIES)}")
+
+DRUG_PATTERNS = [
+    re.compile(r'Drug\s+[A-Z]'),  # Matches "Drug X", "Drug Y"
+    re.compile(r'[A-Z][a-z]+\s*(?:[A-Z][a-z]*)*\s*\d*'),  # Matches capitalized drug names
+]
+
+# Common adverse event keywords
+ADVERSE_KEYWORDS = {
+    'nausea', 'headache', 'dizziness', 'rash', 'fever', 'pain',
+    'vomiting', 'diarrhea', 'fatigue', 'insomnia', 'anxiety',
+    'hypertension', 'hypotension', 'tachycardia', 'bradycardia'
+}
+
+# spaCy model per language, "code=model,code=model"; languages without one
+# (or whose model is not installed) are extracted with the keyword pass
+SPACY_MODELS = os.environ.get("SPACY_MODELS", "en=en_core_web_sm,fr=fr_core_news_sm")
+# Loaded spaCy pipelines kept in memory at once
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", "2"))
+
+
+def _alternation(words) -> str:
+    # Longest first, so "maumivu ya kichwa" wins over "maumivu"
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+class LanguagePipeline:
+    """Keyword tables and compiled patterns for one report language.
+
+    Adverse event keywords map to the English event name, so reports in
+    every language aggregate under the same events.
+    """
+
+    def __init__(self, code: str, model: Optional[str], adverse_keywords: Dict[str, str],
+                 taking_words: List[str], symptom_words: List[str],
+                 severity_keywords: List[Tuple[str, List[str]]],
+                 outcome_keywords: List[Tuple[str, List[str]]]):
+        self.code = code
+        self.model = model
+        self.adverse_keywords = adverse_keywords
+        self.severity_keywords = severity_keywords
+        self.outcome_keywords = outcome_keywords
+        self.taking_pattern = re.compile(r'(?:' + _alternation(taking_words) + r')\s+([^\W\d_]+\s*[^\W\d_]*)', re.IGNORECASE)
+        self.symptom_pattern = re.compile(r'(?:' + _alternation(symptom_words) + r')\s+([^.,]+)', re.IGNORECASE)
+        self.keyword_pattern = re.compile(r'\b(?:' + _alternation(adverse_keywords) + r')\b', re.IGNORECASE)
+
+    def events(self, matches: List[str]) -> List[str]:
+        return [self.adverse_keywords[match.lower()] for match in matches]
+
+
+def _parse_models(value: str) -> Dict[str, str]:
+    models = {}
+    for entry in value.split(","):
+        if "=" in entry:
+            code, model = entry.split("=", 1)
+            models[code.strip()] = model.strip()
+    return models
+
+
+_models = _parse_models(SPACY_MODELS)
+
+PIPELINES = {
+    "en": LanguagePipeline(
+        "en", _models.get("en"),
+        adverse_keywords={keyword: keyword for keyword in ADVERSE_KEYWORDS},
+        taking_words=['taking', 'using', 'administered'],
+        symptom_words=['experienced', 'reported', 'symptoms of', 'including'],
+        severity_keywords=[
+            ("severe", ['severe', 'critical', 'life-threatening', 'emergency']),
+            ("moderate", ['moderate', 'medium', 'significant']),
+            ("mild", ['mild', 'minor', 'slight']),
+        ],
+        outcome_keywords=[
+            ("recovered", ['recovered', 'improved', 'resolved', 'discharged']),
+            ("fatal", ['fatal', 'died', 'death', 'deceased']),
+            ("ongoing", ['ongoing', 'continuing', 'persistent', 'current']),
+        ],
+    ),
+    "fr": LanguagePipeline(
+        "fr", _models.get("fr"),
+        adverse_keywords={
+            'nausée': 'nausea', 'nausées': 'nausea', 'céphalée': 'headache', 'céphalées': 'headache',
+            'mal de tête': 'headache', 'maux de tête': 'headache', 'vertige': 'dizziness',
+            'vertiges': 'dizziness', 'étourdissements': 'dizziness', 'éruption cutanée': 'rash',
+            'fièvre': 'fever', 'douleur': 'pain', 'douleurs': 'pain', 'vomissements': 'vomiting',
+            'diarrhée': 'diarrhea', 'fatigue': 'fatigue', 'insomnie': 'insomnia', 'anxiété': 'anxiety',
+            'hypertension': 'hypertension', 'hypotension': 'hypotension',
+            'tachycardie': 'tachycardia', 'bradycardie': 'bradycardia',
+        },
+        taking_words=['prenant', 'sous', 'traité par', 'traitée par', 'administré'],
+        symptom_words=['a présenté', 'présentait', 'a signalé', 'symptômes de', 'notamment', 'dont'],
+        severity_keywords=[
+            ("severe", ['sévère', 'grave', 'critique', 'urgence', 'potentiellement mortel']),
+            ("moderate", ['modéré', 'modérée', 'significatif', 'significative']),
+            ("mild", ['léger', 'légère', 'mineur', 'mineure']),
+        ],
+        outcome_keywords=[
+            ("recovered", ['rétabli', 'rétablie', 'guéri', 'guérie', 'amélioré', 'résolu', 'sorti']),
+            ("fatal", ['fatal', 'décédé', 'décédée', 'décès']),
+            ("ongoing", ['en cours', 'persistant', 'persistante', 'continu']),
+        ],
+    ),
+    "sw": LanguagePipeline(
+        "sw", _models.get("sw"),
+        adverse_keywords={
+            'kichefuchefu': 'nausea', 'maumivu ya kichwa': 'headache', 'kizunguzungu': 'dizziness',
+            'upele': 'rash', 'homa': 'fever', 'maumivu': 'pain', 'kutapika': 'vomiting',
+            'kuhara': 'diarrhea', 'uchovu': 'fatigue', 'kukosa usingizi': 'insomnia',
+            'wasiwasi': 'anxiety', 'shinikizo la damu': 'hypertension',
+            'shinikizo la chini la damu': 'hypotension',
+            'mapigo ya moyo ya haraka': 'tachycardia', 'mapigo ya moyo ya polepole': 'bradycardia',
+        },
+        taking_words=['akitumia', 'alitumia', 'anatumia', 'alipewa'],
+        symptom_words=['alipata', 'aliripoti', 'dalili za', 'ikiwemo', 'ikiwa ni pamoja na'],
+        severity_keywords=[
+            ("severe", ['kali', 'hatari', 'dharura']),
+            ("moderate", ['wastani']),
+            ("mild", ['kidogo', 'nyepesi']),
+        ],
+        outcome_keywords=[
+            ("recovered", ['amepona', 'alipona', 'amepata nafuu', 'ameruhusiwa']),
+            ("fatal", ['alifariki', 'amefariki', 'kifo']),
+            ("ongoing", ['inaendelea', 'bado anaumwa']),
+        ],
+    ),
+}
+
+if set(PIPELINES) != set(SUPPORTED_LANGUAGES):
+    raise ValueError("Every supported language needs an extraction pipeline")
+
+# English tables under their original names
+TAKING_PATTERN = PIPELINES["en"].taking_pattern
+SYMPTOM_PATTERN = PIPELINES["en"].symptom_pattern
+KEYWORD_PATTERN = PIPELINES["en"].keyword_pattern
+SEVERITY_KEYWORDS = PIPELINES["en"].severity_keywords
+OUTCOME_KEYWORDS = PIPELINES["en"].outcome_keywords
+
+
+class ModelCache:
+    """Bounded LRU cache of loaded spaCy pipelines.
+
+    Loading a language evicts the least recently used one once
+    MODEL_CACHE_SIZE models are in memory. get() returns None for a
+    language without an installed model, and callers fall back to the
+    keyword pass.
+    """
+
+    def __init__(self, max_models: int = MODEL_CACHE_SIZE):
+        self.max_models = max_models
+        self._models: "OrderedDict[str, object]" = OrderedDict()
+        self._missing = set()
+        # Guards the dicts above only; loading a model (possibly downloading
+        # it) holds that language's load lock instead, so requests for
+        # languages already loaded never wait on it
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def _cached(self, language: str) -> Tuple[bool, object]:
+        """(known, model) under the cache lock; known is False if it must be loaded"""
+        with self._lock:
+            nlp = self._models.get(language)
+            if nlp is not None:
+                self._models.move_to_end(language)
+                return True, nlp
+            return language in self._missing, None
+
+    def get(self, language: str):
+        known, nlp = self._cached(language)
+        if known:
+            return nlp
+        with self._lock:
+            load_lock = self._load_locks.setdefault(language, threading.Lock())
+
+        with load_lock:
+            # Loaded by another thread while this one waited
+            known, nlp = self._cached(language)
+            if known:
+                return nlp
+            pipeline = PIPELINES.get(language)
+            nlp = self._load(language, pipeline.model) if pipeline is not None and pipeline.model else None
+            with self._lock:
+                if nlp is None:
+                    self._missing.add(language)
+                    return None
+                self._models[language] = nlp
+                if len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    print(f"[INFO] Evicted spaCy model for '{evicted}'")
+            return nlp
+
+    def _load(self, language: str, model: str):
+        import spacy
+        try:
+            return spacy.load(model)
+        except OSError:
+            if language != "en":
+                print(f"[WARNING] spaCy model {model} is not installed; '{language}' reports use keyword rules")
+                return None
+            print("Downloading spaCy model...")
+            from spacy.cli import download
+            download(model)
+            return spacy.load(model)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._models)
+
+
+model_cache = ModelCache()
+
+
+def get_nlp(language: str = "en"):
+    """Load the spaCy model for a language on first use"""
+    return model_cache.get(language)
+
+
+class ExtractionStats:
+    """Counts and latency of each extraction path"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths: Dict[str, Dict[str, float]] = {}
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            stats = self._paths.setdefault(path, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                path: {
+                    "count": int(stats["count"]),
+                    "avg_ms": round(stats["total_seconds"] / stats["count"] * 1000, 3),
+                    "max_ms": round(stats["max_seconds"] * 1000, 3),
+                    "per_second": round(stats["count"] / stats["total_seconds"], 1) if stats["total_seconds"] else None,
+                }
+                for path, stats in self._paths.items()
+            }
+
+
+# Per extraction path, and per language for the whole report
+extraction_stats = ExtractionStats()
+language_stats = ExtractionStats()
+
+
+def extract_drug_name(text: str, pipeline: Optional[LanguagePipeline] = None) -> str:
+    """Extract drug name using rule-based patterns"""
+    pipeline = pipeline or PIPELINES["en"]
+    for pattern in DRUG_PATTERNS:
+        matches = pattern.findall(text)
+        if matches:
+            return matches[0]
+
+    # Fallback: look for words after "taking", "using", "administered"
+    matches = pipeline.taking_pattern.search(text)
+    if matches:
+        return matches.group(1)
+
+    return "Unknown Drug"
+
+
+def rule_adverse_events(text: str, pipeline: Optional[LanguagePipeline] = None) -> Tuple[List[str], float]:
+    """Extract adverse events with the keyword pass only.
+
+    Returns the events and a confidence: keywords following a phrase such as
+    "experienced" or "symptoms of" are trusted, keywords found anywhere else
+    in the text less so.
+    """
+    pipeline = pipeline or PIPELINES["en"]
+    matches = pipeline.symptom_pattern.search(text)
+    if matches:
+        events = pipeline.events(pipeline.keyword_pattern.findall(matches.group(1)))
+        if events:
+            return events, 1.0
+
+    events = pipeline.events(pipeline.keyword_pattern.findall(text))
+    if events:
+        return events, 0.5
+    return [], 0.0
+
+
+def ner_adverse_events(text: str, nlp=None, pipeline: Optional[LanguagePipeline] = None) -> List[str]:
+    """Extract adverse events using NLP"""
+    pipeline = pipeline or PIPELINES["en"]
+    doc = (nlp or get_nlp())(text)
+    adverse_events = []
+
+    # Extract medical conditions/symptoms
+    for ent in doc.ents:
+        keyword = pipeline.adverse_keywords.get(ent.text.lower())
+        if keyword is not None:
+            adverse_events.append(keyword)
+        elif ent.label_ in ["SYMPTOM", "DISEASE"]:
+            adverse_events.append(ent.text.lower())
+
+    # Fallback: look for keywords near "experienced", "reported", "symptoms"
+    if not adverse_events:
+        matches = pipeline.symptom_pattern.search(text)
+        if matches:
+            adverse_events = pipeline.events(pipeline.keyword_pattern.findall(matches.group(1)))
+
+    return adverse_events
+
+
+def extract_adverse_events(text: str, strategy: Optional[str] = None, language: str = "en") -> List[str]:
+    """Extract adverse events with the given strategy (deployment default if None)"""
+    strategy = strategy or EXTRACTION_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown extraction strategy: {strategy}")
+    pipeline = PIPELINES[language]
+
+    # spaCy is only loaded once a path actually needs it
+    start = time.perf_counter()
+    if strategy == "rules-only":
+        adverse_events, _ = rule_adverse_events(text, pipeline)
+        path = "rules"
+    elif strategy == "ner-only":
+        nlp = model_cache.get(language)
+        if nlp is None:
+            # No model for this language: keyword pass only
+            adverse_events, _ = rule_adverse_events(text, pipeline)
+            path = "rules:no-model"
+        else:
+            adverse_events = ner_adverse_events(text, nlp, pipeline)
+            path = "ner"
+    else:
+        adverse_events, confidence = rule_adverse_events(text, pipeline)
+        path = "cascade:rules"
+        if confidence < CASCADE_MIN_CONFIDENCE:
+            nlp = model_cache.get(language)
+            if nlp is None:
+                path = "rules:no-model"
+            else:
+                # Low-confidence keyword hits are kept alongside whatever
+                # NER finds, so an empty NER result never loses them
+                adverse_events = adverse_events + ner_adverse_events(text, nlp, pipeline)
+                path = "cascade:ner"
+    extraction_stats.record(path, time.perf_counter() - start)
+
+    return list(set(adverse_events)) if adverse_events else ["unknown symptoms"]
+
+
+def determine_severity(text: str, pipeline: Optional[LanguagePipeline] = None) -> str:
+    """Determine severity based on keywords"""
+    pipeline = pipeline or PIPELINES["en"]
+    text_lower = text.lower()
+
+    for severity, words in pipeline.severity_keywords:
+        if any(word in text_lower for word in words):
+            return severity
+    return "unknown"
+
+
+def determine_outcome(text: str, pipeline: Optional[LanguagePipeline] = None) -> str:
+    """Determine patient outcome"""
+    pipeline = pipeline or PIPELINES["en"]
+    text_lower = text.lower()
+
+    for outcome, words in pipeline.outcome_keywords:
+        if any(word in text_lower for word in words):
+            return outcome
+    return "unknown"
+
+
+def extract_report(text: str, strategy: Optional[str] = None, language: Optional[str] = None) -> Dict:
+    """Run every extractor over a report narrative, in its detected language"""
+    if language is None:
+        language = detect_language(text)
+    elif language not in SUPPORTED_LANGUAGES:
+        raise ValueError(f"Unsupported report language: {language}")
+    pipeline = PIPELINES[language]
+
+    start = time.perf_counter()
+    extracted = {
+        "drug": extract_drug_name(text, pipeline),
+        "adverse_events": extract_adverse_events(text, strategy, language),
+        "severity": determine_severity(text, pipeline),
+        "outcome": determine_outcome(text, pipeline),
+        "language": language,
+    }
+    language_stats.record(language, time.perf_counter() - start)
+    return extracted
@@ -0,0 +1,59 @@
+import os
+import re
+from typing import Dict, Optional
+
+# Languages reports are accepted in; each has an extraction pipeline in
+# app/extraction.py
+SUPPORTED_LANGUAGES = {
+    "en": "English",
+    "fr": "French",
+    "sw": "Swahili",
+}
+DEFAULT_LANGUAGE = os.environ.get("DEFAULT_LANGUAGE", "en")
+if DEFAULT_LANGUAGE not in SUPPORTED_LANGUAGES:
+    raise ValueError(f"DEFAULT_LANGUAGE must be one of {', '.join(SUPPORTED_LANGUAGES)}")
+# Only the first words of a narrative are looked at
+LANGUAGE_SAMPLE_WORDS = int(os.environ.get("LANGUAGE_SAMPLE_WORDS", "200"))
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Short, frequent function words that rarely appear in the other languages
+STOPWORDS = {
+    "en": {
+        "the", "and", "of", "to", "with", "was", "is", "in", "after", "patient",
+        "has", "had", "been", "for", "on", "a", "an", "he", "she", "they",
+        "his", "her", "their", "while", "taking", "experienced", "reported", "who",
+    },
+    "fr": {
+        "le", "la", "les", "des", "du", "de", "et", "un", "une", "avec", "est",
+        "a", "au", "aux", "après", "pour", "dans", "sur", "il", "elle", "patient",
+        "patiente", "qui", "pendant", "sous", "présenté", "été", "son", "sa",
+    },
+    "sw": {
+        "na", "ya", "wa", "za", "la", "kwa", "ni", "baada", "mgonjwa", "alipata",
+        "akitumia", "dawa", "katika", "kama", "pia", "hali", "yake", "aliripoti",
+        "amepona", "dalili", "wakati", "kuwa", "huyo", "siku",
+    },
+}
+
+
+def language_scores(text: str) -> Dict[str, int]:
+    """Stopword hits per supported language in the start of a text"""
+    scores = {language: 0 for language in STOPWORDS}
+    for count, match in enumerate(WORD_PATTERN.finditer(text)):
+        if count >= LANGUAGE_SAMPLE_WORDS:
+            break
+        word = match.group(0).lower()
+        for language, words in STOPWORDS.items():
+            if word in words:
+                scores[language] += 1
+    return scores
+
+
+def detect_language(text: str, default: Optional[str] = None) -> str:
+    """Language code of a narrative, without any network or model calls"""
+    scores = language_scores(text)
+    language, score = max(scores.items(), key=lambda item: item[1])
+    if score == 0:
+        return default or DEFAULT_LANGUAGE
+    return language
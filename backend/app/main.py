@@ -1,24 +1,51 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, File, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Dict
-import spacy
-import re
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import datetime
 import os
 from dotenv import load_dotenv
 
-from .database import SessionLocal, engine, Base
+from .database import SessionLocal, init_db
 from .models import Report
-from .translation import translate_text
+from .analytics import GROUP_BY_FIELDS, analytics_store
+from .admission import admission, extraction_slot, scheduler
+from .caching import cached_response, invalidate
+from .changes import CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, changes_since
+from .events import ChangeLogTailer, broadcaster
+from .narratives import attach_narrative, narrative_text
+from .extraction import (
+    EXTRACTION_STRATEGY,
+    EXTRACTION_VERSION,
+    STRATEGIES,
+    extract_report,
+    extraction_stats,
+    get_nlp,
+    language_stats,
+    model_cache,
+)
+from .language import SUPPORTED_LANGUAGES
+from . import archive, profiling
+from .documents import ALLOWED_CONTENT_TYPES, ENTITY_FIELDS, document_entities, search_entities, store_document
+from .schemas import ProcessedReport, ReportOut
+from .serialization import ORJSONResponse, encode_response
+from .tenants import router, tenant_from_request
+from .translation import translate_text, translation_memory
+from .utils import extract_text_from_file, process_medical_file, validate_file_size
+from .writer import GROUP_COMMIT_ENABLED, writer
 
 # Load environment variables from .env
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-print("[INFO] Database tables created (or already exist). If you see 'no such table' errors, delete reports.db and restart.")
-
-app = FastAPI(title="Feyti Medical Report Assistant", version="1.0.0")
+app = FastAPI(
+    title="Feyti Medical Report Assistant",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -32,163 +59,381 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Downloading spaCy model...")
-    from spacy.cli import download
-    download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
-
-# Database dependency
-def get_db():
-    db = SessionLocal()
+# Request profiling is opt-in; nothing is installed unless it is enabled
+if profiling.PROFILING_ENABLED:
+    profiling.install(app)
+
+# Load spaCy model up front (in the launcher's master process when preloading)
+# unless this deployment never calls it
+if EXTRACTION_STRATEGY != "rules-only":
+    get_nlp()
+
+@app.on_event("startup")
+async def startup():
+    # No-op in workers forked by the production launcher, which has already
+    # created the schema in the parent process
+    init_db()
+    if GROUP_COMMIT_ENABLED:
+        await writer.start()
+    await report_feed.start()
+    if analytics_store is not None:
+        db = SessionLocal()
+        try:
+            await run_in_threadpool(analytics_store.refresh, db, True)
+        finally:
+            db.close()
+        print(f"[INFO] Analytics store loaded {analytics_store.size} reports")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await report_feed.stop()
+    await writer.stop()
+
+# Database dependency: the tenant's shard, or the default database
+def get_db(request: Request):
+    tenant = tenant_from_request(request)
+    request.state.tenant = tenant
+    db = router.session(tenant)
     try:
         yield db
     finally:
         db.close()
 
-def extract_drug_name(text: str) -> str:
-    """Extract drug name using rule-based patterns"""
-    # Pattern for drug names (typically capitalized words like "Drug X")
-    drug_patterns = [
-        r'Drug\s+[A-Z]',  # Matches "Drug X", "Drug Y"
-        r'[A-Z][a-z]+\s*(?:[A-Z][a-z]*)*\s*\d*',  # Matches capitalized drug names
-    ]
-    
-    for pattern in drug_patterns:
-        matches = re.findall(pattern, text)
-        if matches:
-            return matches[0]
-    
-    # Fallback: look for words after "taking", "using", "administered"
-    taking_pattern = r'(?:taking|using|administered)\s+([A-Za-z]+\s*[A-Za-z]*)'
-    matches = re.search(taking_pattern, text, re.IGNORECASE)
-    if matches:
-        return matches.group(1)
-    
-    return "Unknown Drug"
-
-def extract_adverse_events(text: str) -> List[str]:
-    """Extract adverse events using NLP"""
-    doc = nlp(text)
-    adverse_events = []
-    
-    # Common adverse event keywords
-    adverse_keywords = {
-        'nausea', 'headache', 'dizziness', 'rash', 'fever', 'pain', 
-        'vomiting', 'diarrhea', 'fatigue', 'insomnia', 'anxiety',
-        'hypertension', 'hypotension', 'tachycardia', 'bradycardia'
-    }
-    
-    # Extract medical conditions/symptoms
-    for ent in doc.ents:
-        if ent.label_ in ["SYMPTOM", "DISEASE"] or ent.text.lower() in adverse_keywords:
-            adverse_events.append(ent.text.lower())
-    
-    # Fallback: look for words near "experienced", "reported", "symptoms"
-    if not adverse_events:
-        symptom_pattern = r'(?:experienced|reported|symptoms of|including)\s+([^.,]+)'
-        matches = re.search(symptom_pattern, text, re.IGNORECASE)
-        if matches:
-            symptoms_text = matches.group(1)
-            # Simple word-based extraction
-            words = symptoms_text.lower().split()
-            adverse_events = [word for word in words if word in adverse_keywords]
-    
-    return list(set(adverse_events)) if adverse_events else ["unknown symptoms"]
-
-def determine_severity(text: str) -> str:
-    """Determine severity based on keywords"""
-    text_lower = text.lower()
-    
-    if any(word in text_lower for word in ['severe', 'critical', 'life-threatening', 'emergency']):
-        return "severe"
-    elif any(word in text_lower for word in ['moderate', 'medium', 'significant']):
-        return "moderate"
-    elif any(word in text_lower for word in ['mild', 'minor', 'slight']):
-        return "mild"
-    else:
-        return "unknown"
-
-def determine_outcome(text: str) -> str:
-    """Determine patient outcome"""
-    text_lower = text.lower()
-    
-    if any(word in text_lower for word in ['recovered', 'improved', 'resolved', 'discharged']):
-        return "recovered"
-    elif any(word in text_lower for word in ['fatal', 'died', 'death', 'deceased']):
-        return "fatal"
-    elif any(word in text_lower for word in ['ongoing', 'continuing', 'persistent', 'current']):
-        return "ongoing"
-    else:
-        return "unknown"
-
-@app.post("/process-report")
-async def process_report(report_data: dict, db: Session = Depends(get_db)):
+@app.post("/process-report", response_model=ProcessedReport)
+async def process_report(report_data: dict, request: Request, db: Session = Depends(get_db)):
     """Process medical report and extract structured data"""
+    tenant = request.state.tenant
+    client, request_class = admission.identify(request)
+    admission.admit(client, request_class)
+
+    strategy = report_data.get("strategy")
+    if strategy is not None and strategy not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Supported strategies: {', '.join(STRATEGIES)}")
+    language = report_data.get("language")
+    if language is not None and language not in SUPPORTED_LANGUAGES:
+        raise HTTPException(status_code=400, detail=f"Supported languages: {', '.join(SUPPORTED_LANGUAGES)}")
+
     try:
         report_text = report_data.get("report", "")
         
         if not report_text:
             raise HTTPException(status_code=400, detail="Report text is required")
         
-        # Extract structured data
-        drug = extract_drug_name(report_text)
-        adverse_events = extract_adverse_events(report_text)
-        severity = determine_severity(report_text)
-        outcome = determine_outcome(report_text)
+        # Extract structured data off the event loop, in weighted fair order
+        # so interactive requests are served ahead of bulk traffic
+        async with extraction_slot(client, request_class):
+            extracted = await run_in_threadpool(profiling.in_worker(extract_report), report_text, strategy, language)
+        drug = extracted["drug"]
+        adverse_events = extracted["adverse_events"]
+        severity = extracted["severity"]
+        outcome = extracted["outcome"]
+        language = extracted["language"]
         
         # Save to database
+        created_at = datetime.datetime.utcnow()
         db_report = Report(
-            report_text=report_text,
             drug=drug,
             adverse_events=",".join(adverse_events),
             severity=severity,
-            outcome=outcome
+            outcome=outcome,
+            extraction_version=EXTRACTION_VERSION,
+            language=language,
+            created_at=created_at
         )
-        db.add(db_report)
-        db.commit()
-        db.refresh(db_report)
+        attach_narrative(db, db_report, report_text)
+        if writer.running:
+            report_id = await writer.submit(db_report, router.session_factory(tenant))
+        else:
+            def save():
+                db.add(db_report)
+                db.commit()
+                db.refresh(db_report)
+                return db_report.id
+            report_id = await run_in_threadpool(save)
+        invalidate()
+        if analytics_store is not None and tenant is None:
+            analytics_store.append(report_id, drug, severity, outcome, adverse_events, created_at)
         
         response = {
-            "id": db_report.id,
+            "id": report_id,
             "drug": drug,
             "adverse_events": adverse_events,
             "severity": severity,
             "outcome": outcome,
-            "original_report": report_text
+            "original_report": report_text,
+            "language": language
         }
         print("[DEBUG] Returning processed report:", response)
-        return response
+        return encode_response(request, response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print("[ERROR] Exception in /process-report:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error processing report: {str(e)}")
 
-@app.get("/reports")
-async def get_reports(db: Session = Depends(get_db)):
+def serialize_report(db: Session, report: Report) -> Dict:
+    return {
+        "id": report.id,
+        "drug": report.drug,
+        "adverse_events": report.adverse_events.split(","),
+        "severity": report.severity,
+        "outcome": report.outcome,
+        "original_report": narrative_text(db, report),
+        "language": report.language,
+        "created_at": report.created_at.isoformat()
+    }
+
+# Streams are fed from the change log, so they carry every worker's reports
+report_feed = ChangeLogTailer(broadcaster, router.session, serialize_report)
+
+@app.get("/reports", response_model=List[ReportOut])
+async def get_reports(request: Request, db: Session = Depends(get_db)):
     """Get all processed reports"""
-    reports = db.query(Report).order_by(Report.created_at.desc()).all()
-    
-    return [
-        {
-            "id": report.id,
-            "drug": report.drug,
-            "adverse_events": report.adverse_events.split(","),
-            "severity": report.severity,
-            "outcome": report.outcome,
-            "original_report": report.report_text,
-            "created_at": report.created_at.isoformat()
-        }
-        for report in reports
-    ]
+    def build():
+        reports = (
+            db.query(Report)
+            .options(selectinload(Report.narrative))
+            .order_by(Report.created_at.desc())
+            .all()
+        )
+        return [serialize_report(db, report) for report in reports]
+
+    # The query, narrative decompression and encoding all happen on a miss
+    return await run_in_threadpool(cached_response, request, db, build)
+
+@app.get("/reports/changes")
+async def get_report_changes(since: int = 0, limit: int = CHANGES_PAGE_SIZE, db: Session = Depends(get_db)):
+    """Reports inserted, updated or deleted after the `since` cursor.
+
+    Start with since=0, then pass back next_cursor until has_more is false.
+    """
+    if since < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="since must be >= 0 and limit >= 1")
+    return await run_in_threadpool(changes_since, db, since, min(limit, CHANGES_MAX_PAGE_SIZE), serialize_report)
+
+@app.get("/reports/stream")
+async def stream_reports(request: Request, deltas: bool = False):
+    """Server-sent events: one `report` event per newly processed report,
+    plus a `stats` event with the aggregate changes when deltas=true.
+    Reconnecting clients get the reports they missed, or a `resync` event"""
+    last_event_id = request.headers.get("last-event-id")
+    tenant = tenant_from_request(request)
+    await report_feed.watch(tenant)
+    subscriber = broadcaster.subscribe(
+        deltas=deltas,
+        tenant=tenant,
+        last_event_id=int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    )
+    return StreamingResponse(
+        broadcaster.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def report_stats(db: Session) -> Dict:
+    """Aggregate counts over the reports in one database"""
+    by_severity = dict(db.query(Report.severity, func.count(Report.id)).group_by(Report.severity).all())
+    by_outcome = dict(db.query(Report.outcome, func.count(Report.id)).group_by(Report.outcome).all())
+    by_drug = dict(db.query(Report.drug, func.count(Report.id)).group_by(Report.drug).all())
+
+    by_adverse_event: Dict[str, int] = {}
+    for (adverse_events,) in db.query(Report.adverse_events):
+        for event in adverse_events.split(","):
+            by_adverse_event[event] = by_adverse_event.get(event, 0) + 1
+
+    return {
+        "total_reports": sum(by_severity.values()),
+        "by_severity": by_severity,
+        "by_outcome": by_outcome,
+        "by_drug": by_drug,
+        "by_adverse_event": by_adverse_event
+    }
+
+def shard_stats(tenant: Optional[str]) -> Dict:
+    with router.scan(tenant) as db:
+        return report_stats(db)
+
+@app.get("/stats")
+async def get_stats(request: Request, db: Session = Depends(get_db)):
+    """Get aggregate counts over all processed reports (of the request's tenant)"""
+    return await run_in_threadpool(cached_response, request, db, lambda: report_stats(db))
+
+@app.get("/stats/global")
+async def get_global_stats():
+    """Aggregate counts over the default database and every tenant shard"""
+    tenants = [None] + router.tenants()
+
+    def collect():
+        # Each shard is a separate database, so they are queried in parallel
+        with ThreadPoolExecutor(max_workers=min(8, len(tenants))) as pool:
+            return list(pool.map(shard_stats, tenants))
+
+    totals = {"total_reports": 0, "by_severity": {}, "by_outcome": {}, "by_drug": {}, "by_adverse_event": {}}
+    by_tenant = {}
+    for tenant, stats in zip(tenants, await run_in_threadpool(collect)):
+        # A tenant may be called "default", so the default database is counted apart
+        if tenant is None:
+            totals["default_reports"] = stats["total_reports"]
+        else:
+            by_tenant[tenant] = stats["total_reports"]
+        totals["total_reports"] += stats["total_reports"]
+        for field in ("by_severity", "by_outcome", "by_drug", "by_adverse_event"):
+            for value, count in stats[field].items():
+                totals[field][value] = totals[field].get(value, 0) + count
+    totals["by_tenant"] = by_tenant
+    return totals
+
+def reject_tenant(request: Request, feature: str):
+    if tenant_from_request(request) is not None:
+        raise HTTPException(status_code=400, detail=f"{feature} is only available for the default database, not tenant shards")
+
+@app.get("/archive")
+async def list_archives(request: Request):
+    """List monthly archive databases and how many reports each holds"""
+    tenant = tenant_from_request(request)
+
+    def collect():
+        return [{"month": month, "reports": archive.count_reports(month, tenant)} for month in archive.list_months(tenant)]
+
+    return await run_in_threadpool(collect)
+
+@app.get("/archive/{month}/reports", response_model=List[ReportOut])
+async def get_archived_reports(month: str, request: Request, limit: int = 100, offset: int = 0):
+    """Get reports from the archive of a YYYY-MM month"""
+    tenant = tenant_from_request(request)
+
+    def build():
+        try:
+            archive_db = archive.archive_session(month, tenant=tenant)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="No archive for this month")
+
+        try:
+            reports = (
+                archive_db.query(Report)
+                .options(selectinload(Report.narrative))
+                .order_by(Report.created_at.desc())
+                .offset(offset)
+                .limit(limit)
+                .all()
+            )
+            return encode_response(request, [serialize_report(archive_db, report) for report in reports])
+        finally:
+            archive_db.close()
+
+    return await run_in_threadpool(build)
+
+@app.get("/analytics/query")
+async def query_analytics(
+    request: Request,
+    drug: Optional[str] = None,
+    severity: Optional[str] = None,
+    outcome: Optional[str] = None,
+    adverse_event: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    group_by: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Count reports matching the filters using the in-memory analytics store"""
+    reject_tenant(request, "The analytics store")
+    if analytics_store is None:
+        raise HTTPException(status_code=503, detail="Analytics store is disabled (set ANALYTICS_STORE_ENABLED and install numpy)")
+    if group_by is not None and group_by not in GROUP_BY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(GROUP_BY_FIELDS)}")
+
+    await run_in_threadpool(analytics_store.refresh, db)
+    return analytics_store.query(
+        drug=drug,
+        severity=severity,
+        outcome=outcome,
+        adverse_event=adverse_event,
+        since=since,
+        until=until,
+        group_by=group_by
+    )
+
+@app.get("/metrics/stream")
+async def get_stream_metrics():
+    """Connected stream clients and how many were dropped for falling behind"""
+    return {
+        "subscribers": len(broadcaster.subscribers),
+        "dropped_total": broadcaster.dropped_total
+    }
+
+@app.get("/metrics/clients")
+async def get_client_metrics():
+    """Per-client admission counts and extraction queue state"""
+    return {
+        "extraction_slots_free": scheduler.free,
+        "extraction_queue": scheduler.waiting,
+        "clients": admission.snapshot()
+    }
+
+@app.get("/metrics/extraction")
+async def get_extraction_metrics():
+    """How often each extraction path was taken and how long it took"""
+    return {
+        "default_strategy": EXTRACTION_STRATEGY,
+        "paths": extraction_stats.snapshot(),
+        "languages": language_stats.snapshot(),
+        "models_loaded": model_cache.loaded()
+    }
+
+@app.post("/upload-report")
+async def upload_report(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Extract a medical document and index the entities found in it"""
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Supported: PDF, DOC, DOCX, TXT")
+    content = await file.read()
+    if not validate_file_size(content):
+        raise HTTPException(status_code=400, detail="File is larger than 10 MB")
+
+    try:
+        text = await run_in_threadpool(profiling.in_worker(extract_text_from_file), content, file.content_type)
+        processed_data = await run_in_threadpool(profiling.in_worker(process_medical_file), text)
+        document = await run_in_threadpool(store_document, db, file.filename, file.content_type, text, processed_data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+
+    return {
+        "status": "success",
+        "id": document.id,
+        "filename": document.filename,
+        "extracted_text": text,
+        "processed_data": processed_data
+    }
+
+@app.get("/entities/search")
+async def search_documents_by_entity(type: str, text: str, limit: int = 100, offset: int = 0,
+                                     db: Session = Depends(get_db)):
+    """Documents containing an entity, e.g. ?type=medication&text=metformin"""
+    if type not in ENTITY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Supported entity types: {', '.join(ENTITY_FIELDS)}")
+    return await run_in_threadpool(search_entities, db, type, text, min(limit, 1000), offset)
+
+@app.get("/documents/{document_id}/entities")
+async def get_document_entities(document_id: int, type: Optional[str] = None, db: Session = Depends(get_db)):
+    """Entity spans of one document, in text order"""
+    if type is not None and type not in ENTITY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Supported entity types: {', '.join(ENTITY_FIELDS)}")
+    entities = await run_in_threadpool(document_entities, db, document_id, type)
+    if entities is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return entities
+
+@app.get("/metrics/translation")
+async def get_translation_metrics():
+    """Translation memory hit rate and characters not sent to the backend"""
+    return translation_memory.snapshot()
 
 @app.post("/translate")
-async def translate_report(translation_data: dict):
+async def translate_report(translation_data: dict, db: Session = Depends(get_db)):
     """Translate text to French or Swahili"""
     try:
         text = translation_data.get("text", "")
@@ -200,7 +445,9 @@ async def translate_report(translation_data: dict):
         if target_lang not in ["fr", "sw"]:
             raise HTTPException(status_code=400, detail="Supported languages: fr (French), sw (Swahili)")
         
-        translated_text = translate_text(text, target_lang)
+        # Blocking backend call; only sentences missing from the translation
+        # memory are sent
+        translated_text = await run_in_threadpool(translate_text, text, target_lang, db)
         
         return {
             "original_text": text,
@@ -208,6 +455,8 @@ async def translate_report(translation_data: dict):
             "target_language": "French" if target_lang == "fr" else "Swahili"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Translation error: {str(e)}")
 
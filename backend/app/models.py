@@ -1,5 +1,6 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, LargeBinary, ForeignKey, UniqueConstraint, Float, Index
+from sqlalchemy.orm import relationship
 import datetime
 from .database import Base
 
@@ -7,9 +8,92 @@ class Report(Base):
     __tablename__ = "reports"
     
     id = Column(Integer, primary_key=True, index=True)
-    report_text = Column(Text, nullable=False)
+    # Legacy uncompressed narrative; new reports keep it in ReportNarrative
+    # and leave this empty
+    report_text = Column(Text, nullable=False, default="")
     drug = Column(String(255), nullable=False)
     adverse_events = Column(Text, nullable=False)  # Comma-separated list
     severity = Column(String(50), nullable=False)
     outcome = Column(String(50), nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    # EXTRACTION_VERSION the structured fields were produced with; NULL for
+    # reports stored before versioning
+    extraction_version = Column(Integer, nullable=True, index=True)
+    # Detected (or client-supplied) narrative language; NULL for reports
+    # stored before language routing
+    language = Column(String(8), nullable=True, index=True)
+
+    narrative = relationship("ReportNarrative", uselist=False, cascade="all, delete-orphan")
+
+class ReportNarrative(Base):
+    """Compressed report narrative, kept out of the hot reports table"""
+    __tablename__ = "report_narratives"
+
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String(16), nullable=False)  # "zstd" or "zlib"
+    dictionary_id = Column(Integer, ForeignKey("narrative_dictionaries.id"), nullable=True)
+    body = Column(LargeBinary, nullable=False)
+
+class NarrativeDictionary(Base):
+    """zstd dictionary trained on stored narratives"""
+    __tablename__ = "narrative_dictionaries"
+
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class TranslationSegment(Base):
+    """Translation memory: one translated sentence per target language"""
+    __tablename__ = "translation_segments"
+    __table_args__ = (UniqueConstraint("target_lang", "source_hash"),)
+
+    id = Column(Integer, primary_key=True)
+    target_lang = Column(String(8), nullable=False)
+    # sha1 of the normalized source sentence
+    source_hash = Column(String(40), nullable=False)
+    source_text = Column(Text, nullable=False)
+    translated_text = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class Document(Base):
+    """An uploaded medical document and its extracted text"""
+    __tablename__ = "documents"
+
+    id = Column(Integer, primary_key=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(128), nullable=False)
+    text = Column(Text, nullable=False)
+    text_hash = Column(String(32), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    entities = relationship("Entity", cascade="all, delete-orphan", order_by="Entity.start_pos")
+
+class Entity(Base):
+    """A medical entity span found in a document"""
+    __tablename__ = "entities"
+    __table_args__ = (Index("ix_entities_type_text", "entity_type", "normalized_text"),)
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    entity_type = Column(String(32), nullable=False)  # diagnosis, medication, symptom, procedure
+    text = Column(Text, nullable=False)
+    # Lowercased, whitespace-collapsed text the search endpoint matches on
+    normalized_text = Column(String(255), nullable=False)
+    # Character offsets into Document.text
+    start_pos = Column(Integer, nullable=False)
+    end_pos = Column(Integer, nullable=False)
+    confidence = Column(Float, nullable=False)
+
+class ReportChange(Base):
+    """Append-only log of report inserts, updates and deletes for delta sync"""
+    __tablename__ = "change_log"
+    # AUTOINCREMENT: sequence numbers are never reused, even after the
+    # newest rows are deleted
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    report_id = Column(Integer, nullable=False, index=True)
+    op = Column(String(8), nullable=False)  # "insert", "update" or "delete"
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
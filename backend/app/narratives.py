@@ -0,0 +1,255 @@
+"""Compressed storage for report narratives.
+
+    python -m app.narratives train-dict [--samples 5000] [--size 65536]
+    python -m app.narratives compress [--batch-size 500] [--vacuum]
+    python -m app.narratives stats
+
+Put --tenant <id> before the command to work on one tenant's shard, or
+--all-tenants for the default database and every shard.
+
+Narratives live in the report_narratives table, compressed with zstd (using
+the latest dictionary trained on the stored corpus, if any) or with zlib
+when zstandard is not installed. The reports table only keeps the small
+metadata columns, so scans over it stay fast.
+"""
+import argparse
+import os
+import random
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import NarrativeDictionary, Report, ReportNarrative
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    print("[WARNING] zstandard is not installed; new narratives are compressed with zlib")
+
+NARRATIVE_ZSTD_LEVEL = int(os.environ.get("NARRATIVE_ZSTD_LEVEL", "3"))
+NARRATIVE_ZLIB_LEVEL = int(os.environ.get("NARRATIVE_ZLIB_LEVEL", "6"))
+
+
+class Codec:
+    """Compresses new narratives and decompresses stored ones.
+
+    Trained dictionaries are cached per process; a dictionary trained after
+    the process started is picked up on restart. Dictionary ids are only
+    unique within one database, so every cache is keyed by the session's
+    tenant shard as well (None for the default database).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dictionaries: Dict[Tuple[Optional[str], int], "zstandard.ZstdCompressionDict"] = {}
+        self._current_dictionary_ids: Dict[Optional[str], Optional[int]] = {}
+        # zstd (de)compressor objects are expensive to set up with a
+        # dictionary but not thread-safe, so each thread keeps its own
+        self._local = threading.local()
+
+    def _dictionary(self, db: Session, dictionary_id: int):
+        key = (db.info.get("shard"), dictionary_id)
+        dictionary = self._dictionaries.get(key)
+        if dictionary is None:
+            row = db.get(NarrativeDictionary, dictionary_id)
+            if row is None:
+                raise ValueError(f"Narrative dictionary {dictionary_id} not found")
+            dictionary = zstandard.ZstdCompressionDict(row.data)
+            self._dictionaries[key] = dictionary
+        return dictionary
+
+    def _current_dictionary_id(self, db: Session) -> Optional[int]:
+        shard = db.info.get("shard")
+        if shard not in self._current_dictionary_ids:
+            with self._lock:
+                if shard not in self._current_dictionary_ids:
+                    self._current_dictionary_ids[shard] = db.query(func.max(NarrativeDictionary.id)).scalar()
+        return self._current_dictionary_ids[shard]
+
+    def reset(self):
+        """Forget cached dictionaries so the next compress() looks them up again"""
+        with self._lock:
+            self._current_dictionary_ids = {}
+            self._dictionaries = {}
+            self._local = threading.local()
+
+    def forget(self, shard: Optional[str]):
+        """Forget what is cached for one shard, e.g. after it was dropped and recreated"""
+        with self._lock:
+            self._current_dictionary_ids.pop(shard, None)
+            self._dictionaries = {key: value for key, value in self._dictionaries.items() if key[0] != shard}
+            # Other threads' (de)compressors cannot be reached one by one
+            self._local = threading.local()
+
+    def compress(self, db: Session, text: str) -> ReportNarrative:
+        """Build the ReportNarrative row for a narrative"""
+        data = text.encode("utf-8")
+        if zstandard is None:
+            return ReportNarrative(codec="zlib", body=zlib.compress(data, NARRATIVE_ZLIB_LEVEL))
+
+        dictionary_id = self._current_dictionary_id(db)
+        compressor = self._cached("compressors", db, dictionary_id)
+        return ReportNarrative(codec="zstd", dictionary_id=dictionary_id, body=compressor.compress(data))
+
+    def decompress(self, db: Session, codec: str, dictionary_id: Optional[int], body: bytes) -> str:
+        if codec == "zlib":
+            return zlib.decompress(body).decode("utf-8")
+        if codec != "zstd":
+            raise ValueError(f"Unknown narrative codec: {codec}")
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed narratives")
+        decompressor = self._cached("decompressors", db, dictionary_id)
+        return decompressor.decompress(body).decode("utf-8")
+
+    def _cached(self, kind: str, db: Session, dictionary_id: Optional[int]):
+        cache = getattr(self._local, kind, None)
+        if cache is None:
+            cache = {}
+            setattr(self._local, kind, cache)
+        key = (db.info.get("shard"), dictionary_id)
+        instance = cache.get(key)
+        if instance is None:
+            dict_data = self._dictionary(db, dictionary_id) if dictionary_id is not None else None
+            if kind == "compressors":
+                instance = zstandard.ZstdCompressor(level=NARRATIVE_ZSTD_LEVEL, dict_data=dict_data)
+            else:
+                instance = zstandard.ZstdDecompressor(dict_data=dict_data)
+            cache[key] = instance
+        return instance
+
+
+codec = Codec()
+
+
+def attach_narrative(db: Session, report: Report, text: str):
+    """Store text as the compressed narrative of a new report"""
+    report.report_text = ""
+    report.narrative = codec.compress(db, text)
+
+
+def narrative_text(db: Session, report: Report) -> str:
+    """Full narrative of a report, compressed or legacy"""
+    narrative = report.narrative
+    if narrative is None:
+        return report.report_text
+    return codec.decompress(db, narrative.codec, narrative.dictionary_id, narrative.body)
+
+
+def train_dictionary(db: Session, samples: int, size: int) -> NarrativeDictionary:
+    """Train a zstd dictionary on a random sample of stored narratives"""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    ids = [report_id for (report_id,) in db.query(Report.id)]
+    if not ids:
+        raise ValueError("No stored narratives to train a dictionary on")
+    sample_ids = random.sample(ids, min(samples, len(ids)))
+    texts = []
+    for start in range(0, len(sample_ids), 500):
+        reports = db.query(Report).filter(Report.id.in_(sample_ids[start:start + 500])).all()
+        texts.extend(narrative_text(db, report).encode("utf-8") for report in reports)
+
+    try:
+        trained = zstandard.train_dictionary(size, texts)
+    except zstandard.ZstdError as e:
+        # zstd needs a corpus many times the dictionary size
+        raise ValueError(f"Could not train a {size} byte dictionary on {len(texts)} narratives: {e}")
+    dictionary = NarrativeDictionary(data=trained.as_bytes(), sample_count=len(texts))
+    db.add(dictionary)
+    db.commit()
+    codec.reset()
+    return dictionary
+
+
+def compress_existing(db: Session, batch_size: int) -> int:
+    """Move legacy report_text values into compressed narratives"""
+    moved = 0
+    last_id = 0
+    while True:
+        reports = (
+            db.query(Report)
+            .outerjoin(ReportNarrative)
+            .filter(ReportNarrative.report_id.is_(None), Report.id > last_id)
+            .order_by(Report.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not reports:
+            return moved
+        for report in reports:
+            attach_narrative(db, report, report.report_text)
+        db.commit()
+        last_id = reports[-1].id
+        moved += len(reports)
+        print(f"[INFO] Compressed {moved} narratives")
+
+
+def print_stats(db: Session):
+    count, stored = db.query(func.count(ReportNarrative.report_id), func.sum(func.length(ReportNarrative.body))).one()
+    legacy = db.query(func.count(Report.id)).filter(Report.report_text != "").scalar()
+    print(f"Compressed narratives: {count} ({stored or 0} bytes)")
+    print(f"Uncompressed legacy narratives: {legacy}")
+    for dictionary in db.query(NarrativeDictionary).order_by(NarrativeDictionary.id):
+        print(f"Dictionary {dictionary.id}: {len(dictionary.data)} bytes from {dictionary.sample_count} samples")
+
+
+def main():
+    from .database import init_db
+    from .tenants import router, validate_tenant
+
+    parser = argparse.ArgumentParser(description="Manage compressed report narratives")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--tenant", help="work on one tenant's shard instead of the default database")
+    scope.add_argument("--all-tenants", action="store_true", help="the default database and every tenant shard")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train-dict", help="train a zstd dictionary on stored narratives")
+    train.add_argument("--samples", type=int, default=5000)
+    train.add_argument("--size", type=int, default=64 * 1024, help="dictionary size in bytes")
+    compress = commands.add_parser("compress", help="compress narratives still stored in reports.report_text")
+    compress.add_argument("--batch-size", type=int, default=500)
+    compress.add_argument("--vacuum", action="store_true", help="reclaim the freed space afterwards")
+    commands.add_parser("stats", help="show narrative storage statistics")
+    args = parser.parse_args()
+
+    if args.all_tenants:
+        tenants = [None] + router.tenants()
+    elif args.tenant:
+        try:
+            tenants = [validate_tenant(args.tenant)]
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        tenants = [None]
+
+    init_db()
+    for tenant in tenants:
+        if len(tenants) > 1:
+            print(f"== {tenant or 'default database'} ==")
+        db = router.session(tenant)
+        try:
+            if args.command == "train-dict":
+                try:
+                    dictionary = train_dictionary(db, args.samples, args.size)
+                except ValueError as e:
+                    print(f"[WARNING] {e}")
+                    continue
+                print(f"[INFO] Trained dictionary {dictionary.id} on {dictionary.sample_count} narratives")
+            elif args.command == "compress":
+                moved = compress_existing(db, args.batch_size)
+                print(f"[INFO] Done: {moved} narratives compressed")
+            else:
+                print_stats(db)
+        finally:
+            db.close()
+
+        if getattr(args, "vacuum", False):
+            with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
+            print("[INFO] Database vacuumed")
+
+
+if __name__ == "__main__":
+    main()
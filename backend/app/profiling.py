@@ -0,0 +1,272 @@
+import cProfile
+import contextvars
+import functools
+import hmac
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+# Profiling is opt-in. When disabled, install() is never called and requests
+# go through no extra code at all.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_PATHS = tuple(p for p in os.environ.get("PROFILE_PATHS", "/process-report").split(",") if p)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+PROFILER = os.environ.get("PROFILER", "cprofile")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+DEBUG_HEADER = "x-debug-profile"
+ADMIN_HEADER = "x-admin-token"
+
+
+class ProfileStore:
+    """Bounded on-disk ring buffer of request profiles.
+
+    Each profile is a pair of files: the profile itself and a JSON sidecar
+    with request metadata. Listing reads the sidecars from disk, so every
+    worker process sees profiles captured by the others.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, max_profiles: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        os.makedirs(directory, exist_ok=True)
+
+    def _meta_path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, meta: Dict, write_profile) -> None:
+        """Store a profile; write_profile(path) writes the profile file"""
+        extension = "html" if meta["profiler"] == "pyinstrument" else "prof"
+        meta["filename"] = f"{meta['id']}.{extension}"
+        write_profile(os.path.join(self.directory, meta["filename"]))
+        with open(self._meta_path(meta["id"]), "w") as f:
+            json.dump(meta, f)
+        self._evict()
+
+    def list(self) -> List[Dict]:
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                # Evicted or half-written by another worker
+                continue
+        return profiles
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(profile_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path_for(self, meta: Dict) -> str:
+        return os.path.join(self.directory, meta["filename"])
+
+    def _evict(self):
+        # Sidecar mtimes order the ring, so no sidecar has to be parsed
+        sidecars = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    sidecars.append((entry.stat().st_mtime, entry.name[:-len(".json")]))
+                except OSError:
+                    continue
+        if len(sidecars) <= self.max_profiles:
+            return
+        sidecars.sort()
+        for _, profile_id in sidecars[:len(sidecars) - self.max_profiles]:
+            for extension in ("prof", "html", "json"):
+                try:
+                    os.remove(os.path.join(self.directory, f"{profile_id}.{extension}"))
+                except OSError:
+                    pass
+
+
+class RequestProfile:
+    """Profilers of one request.
+
+    One profiler runs on the event loop thread for the whole request; work
+    the request hands to worker threads through in_worker() gets a profiler
+    of its own in that thread. write() merges them into one file.
+    """
+
+    def __init__(self, use_pyinstrument: bool):
+        self.use_pyinstrument = use_pyinstrument
+        self.workers = []
+        self._lock = threading.Lock()
+        self.main = self._start(async_mode="enabled")
+
+    def _start(self, async_mode: str = "disabled"):
+        if self.use_pyinstrument:
+            profiler = PyinstrumentProfiler(async_mode=async_mode)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop(self, profiler):
+        if self.use_pyinstrument:
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def stop(self):
+        self._stop(self.main)
+
+    def run_in_worker(self, func: Callable, *args, **kwargs):
+        try:
+            profiler = self._start()
+        except ValueError:
+            # Python 3.12+ allows only one active cProfile per process
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._stop(profiler)
+            with self._lock:
+                self.workers.append(profiler)
+
+    def write(self, path: str):
+        if self.use_pyinstrument:
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+            session = self.main.last_session
+            for profiler in self.workers:
+                session = Session.combine(session, profiler.last_session)
+            with open(path, "w") as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            stats = pstats.Stats(self.main)
+            for profiler in self.workers:
+                stats.add(profiler)
+            stats.dump_stats(path)
+
+
+# Profile of the request being handled, if it is being profiled
+_request_profile: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+# Profilers see every thread they are enabled in, so a second request
+# profiled at the same time would mix its samples into the first one's
+_profiling_lock = threading.Lock()
+
+
+def in_worker(func: Callable) -> Callable:
+    """Wrap func for run_in_threadpool so the thread running it is profiled too"""
+    profile = _request_profile.get()
+    if profile is None:
+        return func
+    return functools.partial(profile.run_in_worker, func)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def should_profile(request: Request) -> bool:
+    if not request.url.path.startswith(PROFILE_PATHS):
+        return False
+    # Forcing a profile costs CPU and disk, so only admins may ask for one
+    if DEBUG_HEADER in request.headers and is_admin(request.headers.get(ADMIN_HEADER)):
+        return True
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def require_admin(x_admin_token: Optional[str]):
+    if not ADMIN_TOKEN:
+        # Fail closed: without a configured token the endpoints do not exist
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def create_router(store: ProfileStore) -> APIRouter:
+    router = APIRouter(prefix="/admin/profiles", tags=["admin"])
+
+    @router.get("")
+    async def list_profiles(limit: int = 20, x_admin_token: str = Header(None)):
+        """List the slowest recently profiled requests"""
+        require_admin(x_admin_token)
+        profiles = sorted(await run_in_threadpool(store.list), key=lambda meta: meta["duration_ms"], reverse=True)
+        return profiles[:limit]
+
+    @router.get("/{profile_id}")
+    async def download_profile(profile_id: str, x_admin_token: str = Header(None)):
+        """Download a captured profile (.prof for cProfile, .html for pyinstrument)"""
+        require_admin(x_admin_token)
+        meta = store.get(profile_id)
+        if meta is None or not os.path.exists(store.path_for(meta)):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(store.path_for(meta), filename=meta["filename"])
+
+    return router
+
+
+def install(app: FastAPI):
+    """Add the sampling middleware and the admin endpoints to the app"""
+    store = ProfileStore()
+    use_pyinstrument = PROFILER == "pyinstrument" and PyinstrumentProfiler is not None
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        if not should_profile(request):
+            return await call_next(request)
+        # Another request is being profiled: serve this one unprofiled
+        if not _profiling_lock.acquire(blocking=False):
+            return await call_next(request)
+
+        # The event loop profiler also sees whatever the loop runs for other
+        # requests meanwhile; worker threads are profiled for this one only.
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            profile = RequestProfile(use_pyinstrument)
+            token = _request_profile.set(profile)
+            try:
+                response = await call_next(request)
+            finally:
+                duration = time.perf_counter() - start
+                profile.stop()
+                _request_profile.reset(token)
+        finally:
+            _profiling_lock.release()
+
+        profile_id = uuid.uuid4().hex
+        await run_in_threadpool(store.save, {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "status_code": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "started_at": started_at,
+            "profiler": "pyinstrument" if use_pyinstrument else "cprofile",
+            "pid": os.getpid()
+        }, profile.write)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    app.include_router(create_router(store))
+    print(f"[INFO] Profiling enabled for {', '.join(PROFILE_PATHS)} (sample rate {PROFILE_SAMPLE_RATE})")
@@ -0,0 +1,231 @@
+"""Re-extract stored reports produced by an older EXTRACTION_VERSION.
+
+    python -m app.reprocess [--workers 2] [--chunk-size 200] [--pause 0.5]
+                            [--tenant <id> | --all-tenants]
+
+Rows are read in id order and extracted in parallel on a process pool, one
+chunk per worker at a time. After each round the results are written back
+and the last processed id is saved to a checkpoint file, so the command can
+be stopped at any point and resumed where it left off. Workers run at a
+lower CPU priority and the command pauses between rounds so live traffic
+keeps the upper hand. Each tenant shard has its own checkpoint file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+
+from .changes import record_changes
+from .database import init_db
+from .extraction import EXTRACTION_STRATEGY, EXTRACTION_VERSION, STRATEGIES, extract_report, get_nlp
+from .language import SUPPORTED_LANGUAGES
+from .models import Report
+from .narratives import narrative_text
+from .tenants import router, validate_tenant
+
+DEFAULT_CHECKPOINT = "reprocess_checkpoint.json"
+
+
+def _init_worker(niceness: int, strategy: str):
+    if niceness:
+        os.nice(niceness)
+    if strategy != "rules-only":
+        get_nlp()
+
+
+def reprocess_chunk(rows: List[Tuple[int, str, Optional[str]]], strategy: str) -> List[Dict]:
+    """Extract a chunk of (id, text, language) rows; runs in a pool worker"""
+    results = []
+    for report_id, report_text, language in rows:
+        # Keep the stored (possibly client-supplied) language; only rows
+        # stored before language routing are detected again
+        if language not in SUPPORTED_LANGUAGES:
+            language = None
+        extracted = extract_report(report_text, strategy, language)
+        results.append({
+            "id": report_id,
+            "drug": extracted["drug"],
+            "adverse_events": ",".join(extracted["adverse_events"]),
+            "severity": extracted["severity"],
+            "outcome": extracted["outcome"],
+            "language": extracted["language"],
+            "extraction_version": EXTRACTION_VERSION,
+        })
+    return results
+
+
+def checkpoint_for(path: str, tenant: Optional[str]) -> str:
+    """Checkpoint file of one shard: reprocess_checkpoint.<tenant>.json"""
+    if tenant is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{tenant}{extension}"
+
+
+def load_checkpoint(path: str) -> int:
+    """Last processed id for the current version, or 0 to start over"""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get("version") != EXTRACTION_VERSION:
+        return 0
+    return checkpoint.get("last_id", 0)
+
+
+def save_checkpoint(path: str, last_id: int, processed: int):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": EXTRACTION_VERSION, "last_id": last_id, "processed": processed}, f)
+    os.replace(tmp_path, path)
+
+
+def fetch_stale(db, after_id: int, limit: int) -> List[Tuple[int, str, Optional[str]]]:
+    reports = (
+        db.query(Report)
+        .options(selectinload(Report.narrative))
+        .filter(Report.id > after_id)
+        .filter(or_(Report.extraction_version.is_(None), Report.extraction_version < EXTRACTION_VERSION))
+        .order_by(Report.id)
+        .limit(limit)
+        .all()
+    )
+    return [(report.id, narrative_text(db, report), report.language) for report in reports]
+
+
+def reprocess_shard(
+    pool,
+    session_factory,
+    workers: int,
+    chunk_size: int,
+    pause: float,
+    strategy: str,
+    checkpoint_path: str,
+    limit: Optional[int] = None,
+) -> int:
+    """Reprocess the stale reports of one database on a running pool"""
+    last_id = load_checkpoint(checkpoint_path)
+    processed = 0
+    if last_id:
+        print(f"[INFO] Resuming after report {last_id}")
+
+    while limit is None or processed < limit:
+        db = session_factory()
+        try:
+            round_size = workers * chunk_size
+            if limit is not None:
+                round_size = min(round_size, limit - processed)
+            rows = fetch_stale(db, last_id, round_size)
+            if not rows:
+                break
+
+            chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+            for results in pool.map(reprocess_chunk, chunks, [strategy] * len(chunks)):
+                db.bulk_update_mappings(Report, results)
+                record_changes(db, [result["id"] for result in results], "update")
+            db.commit()
+        finally:
+            db.close()
+
+        last_id = rows[-1][0]
+        processed += len(rows)
+        save_checkpoint(checkpoint_path, last_id, processed)
+        print(f"[INFO] Reprocessed {processed} reports (up to id {last_id})")
+        if pause:
+            time.sleep(pause)
+    return processed
+
+
+def reprocess(
+    workers: int,
+    chunk_size: int,
+    pause: float,
+    niceness: int = 10,
+    strategy: str = EXTRACTION_STRATEGY,
+    checkpoint_path: str = DEFAULT_CHECKPOINT,
+    limit: Optional[int] = None,
+    tenants: Sequence[Optional[str]] = (None,),
+) -> int:
+    """Reprocess stale reports of each tenant (None: the default database)
+    and return how many were updated"""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown extraction strategy: {strategy}")
+    init_db()
+    processed = 0
+
+    # One pool for every shard, so models are loaded once
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(niceness, strategy)) as pool:
+        for tenant in tenants:
+            if limit is not None and processed >= limit:
+                break
+            if tenant is not None:
+                print(f"[INFO] Reprocessing tenant '{tenant}'")
+            processed += reprocess_shard(
+                pool,
+                router.session_factory(tenant),
+                workers,
+                chunk_size,
+                pause,
+                strategy,
+                checkpoint_for(checkpoint_path, tenant),
+                None if limit is None else limit - processed,
+            )
+
+    print(f"[INFO] Done: {processed} reports now at extraction version {EXTRACTION_VERSION}")
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2),
+                        help="worker processes (default: half the cores)")
+    parser.add_argument("--chunk-size", type=int, default=200, help="reports per worker per round")
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds to sleep between rounds")
+    parser.add_argument("--nice", type=int, default=10, help="niceness increment for workers")
+    parser.add_argument("--strategy", default=EXTRACTION_STRATEGY, choices=STRATEGIES,
+                        help="extraction strategy to use")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="checkpoint file")
+    parser.add_argument("--limit", type=int, help="stop after this many reports")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--tenant", help="reprocess one tenant's shard instead of the default database")
+    scope.add_argument("--all-tenants", action="store_true",
+                       help="reprocess the default database and every tenant shard")
+    args = parser.parse_args()
+
+    if args.all_tenants:
+        tenants = [None] + router.tenants()
+    elif args.tenant:
+        try:
+            tenants = [validate_tenant(args.tenant)]
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        tenants = [None]
+
+    if args.restart:
+        for tenant in tenants:
+            if os.path.exists(checkpoint_for(args.checkpoint, tenant)):
+                os.remove(checkpoint_for(args.checkpoint, tenant))
+
+    reprocess(
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        pause=args.pause,
+        niceness=args.nice,
+        strategy=args.strategy,
+        checkpoint_path=args.checkpoint,
+        limit=args.limit,
+        tenants=tenants,
+    )
+
+
+if __name__ == "__main__":
+    main()
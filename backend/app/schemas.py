@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class ProcessedReport(BaseModel):
+    """Structured data returned by /process-report"""
+    id: int
+    drug: str
+    adverse_events: List[str]
+    severity: str
+    outcome: str
+    original_report: str
+    language: Optional[str] = None
+
+
+class ReportOut(ProcessedReport):
+    """A stored report as returned by /reports"""
+    created_at: Optional[datetime] = None
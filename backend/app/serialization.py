@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+from typing import Any, Dict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Payloads smaller than this are sent uncompressed; compressing a few hundred
+# bytes costs more CPU than it saves on the wire.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class ORJSONResponse(Response):
+    """JSON response rendered with orjson, falling back to the stdlib encoder"""
+    media_type = JSON_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def dumps_json(content: Any) -> bytes:
+    """Serialize content to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    """Serialize content to MessagePack bytes"""
+    return msgpack.packb(content, use_bin_type=True, default=str)
+
+
+def parse_quality_list(header: str) -> Dict[str, float]:
+    """Map each entry of an Accept or Accept-Encoding header to its q-value"""
+    qualities = {}
+    for entry in header.split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities
+
+
+def media_quality(accepted: Dict[str, float], media_type: str) -> float:
+    """q-value of a media type under the most specific matching range"""
+    for candidate in (media_type, media_type.split("/")[0] + "/*", "*/*"):
+        if candidate in accepted:
+            return accepted[candidate]
+    return 0.0
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if the client prefers MessagePack over JSON and it is available"""
+    if msgpack is None:
+        return False
+    accepted = parse_quality_list(request.headers.get("accept", ""))
+    msgpack_quality = max(media_quality(accepted, media_type) for media_type in MSGPACK_MEDIA_TYPES)
+    # JSON wins ties, so "*/*" and missing headers keep getting JSON
+    return msgpack_quality > 0 and msgpack_quality > media_quality(accepted, JSON_MEDIA_TYPE)
+
+
+def compress(body: bytes, accept_encoding: str):
+    """Compress body with the best encoding the client accepts.
+
+    Returns a (body, content_encoding) tuple; content_encoding is None when
+    the body was left as is.
+    """
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+    accepted = parse_quality_list(accept_encoding)
+
+    def quality(encoding: str) -> float:
+        return accepted.get(encoding, accepted.get("*", 0.0))
+
+    br, gz = quality("br") if brotli is not None else 0.0, quality("gzip")
+    if br > 0 and br >= gz:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if gz > 0:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def encode_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """Render content in the format negotiated from the Accept headers.
+
+    The content must already be made of plain JSON types; returning a
+    Response directly means FastAPI skips jsonable_encoder entirely.
+    """
+    if wants_msgpack(request):
+        body = dumps_msgpack(content)
+        media_type = MSGPACK_MEDIA_TYPES[0]
+    else:
+        body = dumps_json(content)
+        media_type = JSON_MEDIA_TYPE
+
+    body, content_encoding = compress(body, request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
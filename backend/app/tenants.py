@@ -0,0 +1,273 @@
+"""Per-tenant database shards.
+
+    python -m app.tenants list
+    python -m app.tenants drop <tenant>
+
+Requests carrying an X-Tenant-ID header (or a ?tenant= query parameter, for
+EventSource clients that cannot set headers) read and write their own shard;
+requests without one use the default reports.db. Only tenants listed in
+TENANTS are served; any other id gets a 404. With the default
+TENANT_DATABASE_URL every tenant gets its own SQLite file, so tenants never
+wait on each other's write lock. A URL without a {tenant} placeholder (e.g.
+postgresql://host/db) keeps every tenant in a "tenant_<id>" schema of that
+one database instead.
+
+Servers notice a dropped SQLite shard on its tenant's next request. With a
+server database, restart them after a drop.
+"""
+import argparse
+import glob
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from .database import SessionLocal, create_schema
+from .narratives import codec
+
+TENANT_DATABASE_URL = os.environ.get("TENANT_DATABASE_URL", "sqlite:///./tenants/{tenant}.db")
+# Tenant engines (and their connection pools) kept open at once
+TENANT_ENGINE_CACHE_SIZE = int(os.environ.get("TENANT_ENGINE_CACHE_SIZE", "32"))
+TENANT_SCHEMA_PREFIX = "tenant_"
+
+TENANT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_]{0,63}$")
+
+
+def validate_tenant(tenant: str) -> str:
+    tenant = tenant.strip().lower()
+    if not TENANT_PATTERN.match(tenant):
+        raise ValueError("Tenant ids are 1-64 letters, digits or '_'")
+    return tenant
+
+
+# Tenants requests may name, e.g. "acme,globex". Anything else is rejected
+# before a shard is created for it.
+TENANTS = frozenset(validate_tenant(t) for t in os.environ.get("TENANTS", "").split(",") if t.strip())
+
+
+class Shard:
+    def __init__(self, tenant: str, engine, owns_engine: bool, path: Optional[str] = None):
+        self.tenant = tenant
+        self.engine = engine
+        # Engines created for one SQLite file are disposed on eviction;
+        # schema-mapped views of the shared Postgres engine are not
+        self.owns_engine = owns_engine
+        # The SQLite file, checked before each use in case it was dropped
+        self.path = path
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"shard": tenant})
+
+
+class ShardRouter:
+    """Bounded LRU cache of per-tenant engines and session factories.
+
+    A shard is created, schema included, the first time its tenant is seen.
+    Engines beyond TENANT_ENGINE_CACHE_SIZE are disposed, least recently
+    used first, and reopened on the tenant's next request. Opening a shard
+    only holds that tenant's open lock, so other tenants are not held up
+    by its schema creation.
+    """
+
+    def __init__(self, url_template: str = TENANT_DATABASE_URL, max_engines: int = TENANT_ENGINE_CACHE_SIZE):
+        self.url_template = url_template
+        self.max_engines = max_engines
+        self.per_file = "{tenant}" in url_template
+        self._shared_engine = None
+        self._shards: "OrderedDict[str, Shard]" = OrderedDict()
+        self._initialized = set()
+        self._lock = threading.Lock()
+        self._open_locks: Dict[str, threading.Lock] = {}
+
+    def _shared(self):
+        with self._lock:
+            if self._shared_engine is None:
+                self._shared_engine = create_engine(self.url_template)
+            return self._shared_engine
+
+    def _connect(self, tenant: str) -> Shard:
+        """Engine and session factory for a tenant, without touching its schema"""
+        if self.per_file:
+            url = make_url(self.url_template.format(tenant=tenant))
+            if url.get_backend_name() == "sqlite":
+                os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+                engine = create_engine(url, connect_args={"check_same_thread": False})
+                return Shard(tenant, engine, owns_engine=True, path=url.database)
+            return Shard(tenant, create_engine(url), owns_engine=True)
+        schema = TENANT_SCHEMA_PREFIX + tenant
+        engine = self._shared().execution_options(schema_translate_map={None: schema})
+        return Shard(tenant, engine, owns_engine=False)
+
+    def _open(self, tenant: str) -> Shard:
+        shard = self._connect(tenant)
+        with self._lock:
+            initialized = tenant in self._initialized
+        if not initialized:
+            schema = None if self.per_file else TENANT_SCHEMA_PREFIX + tenant
+            if schema is not None:
+                with self._shared().begin() as conn:
+                    conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+            create_schema(shard.engine, schema)
+            with self._lock:
+                self._initialized.add(tenant)
+            print(f"[INFO] Opened shard for tenant '{tenant}'")
+        return shard
+
+    def _cached(self, tenant: str) -> Optional[Shard]:
+        with self._lock:
+            shard = self._shards.get(tenant)
+            if shard is not None:
+                self._shards.move_to_end(tenant)
+        if shard is not None and shard.path is not None and not os.path.exists(shard.path):
+            # Dropped by another process: the engine still points at the
+            # deleted file, so forget it and start the shard afresh
+            self._forget(tenant)
+            shard.engine.dispose()
+            return None
+        return shard
+
+    def _forget(self, tenant: str):
+        with self._lock:
+            self._shards.pop(tenant, None)
+            self._initialized.discard(tenant)
+        # Dictionary ids of the old shard mean nothing in a recreated one
+        codec.forget(tenant)
+
+    def shard(self, tenant: str) -> Shard:
+        shard = self._cached(tenant)
+        if shard is not None:
+            return shard
+        with self._lock:
+            open_lock = self._open_locks.setdefault(tenant, threading.Lock())
+
+        with open_lock:
+            # Opened by another thread while this one waited
+            shard = self._cached(tenant)
+            if shard is not None:
+                return shard
+            shard = self._open(tenant)
+            with self._lock:
+                self._shards[tenant] = shard
+                evicted = self._shards.popitem(last=False)[1] if len(self._shards) > self.max_engines else None
+            if evicted is not None and evicted.owns_engine:
+                evicted.engine.dispose()
+            return shard
+
+    @contextmanager
+    def scan(self, tenant: Optional[str]) -> Iterator[Session]:
+        """Session for a one-off read of an existing shard.
+
+        An open shard is used as is; any other gets a temporary engine, so
+        reading every shard does not push the busy ones out of the cache.
+        """
+        if tenant is None:
+            db, engine = SessionLocal(), None
+        else:
+            with self._lock:
+                shard = self._shards.get(tenant)
+            engine = None
+            if shard is None:
+                shard = self._connect(tenant)
+                engine = shard.engine if shard.owns_engine else None
+            db = shard.sessionmaker()
+        try:
+            yield db
+        finally:
+            db.close()
+            if engine is not None:
+                engine.dispose()
+
+    def session(self, tenant: Optional[str]) -> Session:
+        """Session on a tenant's shard, or on the default database for None"""
+        if tenant is None:
+            return SessionLocal()
+        return self.shard(tenant).sessionmaker()
+
+    def session_factory(self, tenant: Optional[str]):
+        return SessionLocal if tenant is None else self.shard(tenant).sessionmaker
+
+    def tenants(self) -> List[str]:
+        """Every tenant that has a shard, including ones not currently open"""
+        if self.per_file:
+            url = make_url(self.url_template)
+            if url.get_backend_name() != "sqlite":
+                with self._lock:
+                    return sorted(self._initialized)
+            prefix, _, suffix = url.database.partition("{tenant}")
+            found = []
+            for path in glob.glob(glob.escape(prefix) + "*" + glob.escape(suffix)):
+                tenant = path[len(prefix):len(path) - len(suffix)]
+                if TENANT_PATTERN.match(tenant):
+                    found.append(tenant)
+            return sorted(found)
+
+        schemas = inspect(self._shared()).get_schema_names()
+        return sorted(name[len(TENANT_SCHEMA_PREFIX):] for name in schemas if name.startswith(TENANT_SCHEMA_PREFIX))
+
+    def drop(self, tenant: str):
+        """Delete a tenant's shard and everything in it"""
+        shard = self.shard(tenant)
+        self._forget(tenant)
+        if shard.owns_engine:
+            shard.engine.dispose()
+            url = make_url(self.url_template.format(tenant=tenant))
+            if url.get_backend_name() == "sqlite":
+                os.remove(url.database)
+            else:
+                raise RuntimeError("Per-tenant server databases must be dropped on the server")
+        else:
+            with self._shared().begin() as conn:
+                conn.execute(text(f'DROP SCHEMA "{TENANT_SCHEMA_PREFIX}{tenant}" CASCADE'))
+
+    def open_count(self) -> int:
+        with self._lock:
+            return len(self._shards)
+
+
+router = ShardRouter()
+
+
+def tenant_from_request(request: Request) -> Optional[str]:
+    """Tenant id of a request, or None for the default database"""
+    tenant = request.headers.get("x-tenant-id") or request.query_params.get("tenant")
+    if not tenant:
+        return None
+    try:
+        tenant = validate_tenant(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if tenant not in TENANTS:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    return tenant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage per-tenant database shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list tenants with a shard")
+    drop = commands.add_parser("drop", help="delete a tenant's shard and all its reports")
+    drop.add_argument("tenant")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for tenant in router.tenants():
+            print(tenant)
+    else:
+        tenant = validate_tenant(args.tenant)
+        if tenant not in router.tenants():
+            parser.error(f"No shard for tenant '{tenant}'")
+        router.drop(tenant)
+        print(f"[INFO] Dropped shard for tenant '{tenant}'")
+        if tenant in TENANTS:
+            print(f"[WARNING] '{tenant}' is still listed in TENANTS; its next request starts an empty shard")
+        if not router.per_file or make_url(router.url_template).get_backend_name() != "sqlite":
+            print("[WARNING] Restart the API servers so they close their connections to the dropped shard")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,231 @@
+import asyncio
+import hashlib
+import inspect
 import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
 from dotenv import load_dotenv
 from googletrans import Translator
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .language import detect_language  # noqa: F401  offline language ID, re-exported
+from .models import TranslationSegment
 
 # Load environment variables from .env
 load_dotenv()
 TRANSLATION_API_KEY = os.environ.get("TRANSLATION_API_KEY")  # Example usage for real API
+# Set to 0 to send every text to the backend as a single unit
+TRANSLATION_MEMORY_ENABLED = os.environ.get("TRANSLATION_MEMORY_ENABLED", "1").lower() in ("1", "true", "yes")
 
-translator = Translator()
+# Sentence boundaries: whitespace after ., ! or ?, and line breaks. The
+# separators are kept so the translated text keeps the original layout.
+SEGMENT_BOUNDARY = re.compile(r'((?<=[.!?])\s+|\s*\n\s*)')
+WHITESPACE = re.compile(r'\s+')
 
-def translate_text(text: str, target_lang: str) -> str:
-    """Translate text to target language"""
-    try:
-        translation = translator.translate(text, dest=target_lang)
-        return translation.text
-    except Exception as e:
-        # Fallback translation dictionary
-        fallback_translations = {
-            'fr': {
-                'recovered': 'rétabli',
-                'ongoing': 'en cours',
-                'fatal': 'fatal',
-                'severe': 'sévère',
-                'moderate': 'modéré',
-                'mild': 'léger'
-            },
-            'sw': {
-                'recovered': 'umepona',
-                'ongoing': 'inaendelea',
-                'fatal': 'kuwa na hatari',
-                'severe': 'kali',
-                'moderate': 'wastani',
-                'mild': 'nyepesi'
-            }
+# Fallback translation dictionary
+FALLBACK_TRANSLATIONS = {
+    'fr': {
+        'recovered': 'rétabli',
+        'ongoing': 'en cours',
+        'fatal': 'fatal',
+        'severe': 'sévère',
+        'moderate': 'modéré',
+        'mild': 'léger'
+    },
+    'sw': {
+        'recovered': 'umepona',
+        'ongoing': 'inaendelea',
+        'fatal': 'kuwa na hatari',
+        'severe': 'kali',
+        'moderate': 'wastani',
+        'mild': 'nyepesi'
+    }
+}
+
+
+def fallback_translate(text: str, target_lang: str) -> str:
+    """Simple word-by-word translation, used when the backend is unavailable"""
+    words = text.lower().split()
+    translated_words = []
+    for word in words:
+        if word in FALLBACK_TRANSLATIONS.get(target_lang, {}):
+            translated_words.append(FALLBACK_TRANSLATIONS[target_lang][word])
+        else:
+            translated_words.append(word)
+
+    return " ".join(translated_words)
+
+
+async def _backend_translate_async(texts: List[str], target_lang: str):
+    # The translator's HTTP client is bound to the event loop it is first
+    # used on, so every call (and asyncio.run loop) gets a translator of its own
+    async with Translator() as translator:
+        return await translator.translate(texts, dest=target_lang)
+
+
+def backend_translate(texts: List[str], target_lang: str) -> List[str]:
+    """Translate several texts with one call to the translation backend"""
+    # googletrans 4.0.2+ is asynchronous; callers run in a worker thread
+    if inspect.iscoroutinefunction(Translator.translate):
+        result = asyncio.run(_backend_translate_async(texts, target_lang))
+    else:
+        result = Translator().translate(texts, dest=target_lang)
+    return [translation.text for translation in result]
+
+
+def split_segments(text: str) -> List[Tuple[str, str]]:
+    """Split text into (sentence, following separator) pairs"""
+    parts = SEGMENT_BOUNDARY.split(text)
+    parts.append("")
+    return [(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2)]
+
+
+def normalize_segment(segment: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFC", segment)).strip()
+
+
+def segment_hash(segment: str) -> str:
+    return hashlib.sha1(segment.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """Sentence-level translation memory backed by the translation_segments table.
+
+    Each sentence is normalized and looked up by hash; only sentences never
+    translated before are sent to the backend, all in one batched call.
+    Fallback translations are never stored.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "segments": 0,
+            "hits": 0,
+            "characters": 0,
+            "characters_saved": 0,
+            "backend_calls": 0,
+            "backend_seconds": 0.0,
+            "fallbacks": 0,
         }
-        
-        # Simple word-by-word translation fallback
-        words = text.lower().split()
-        translated_words = []
-        for word in words:
-            if word in fallback_translations.get(target_lang, {}):
-                translated_words.append(fallback_translations[target_lang][word])
-            else:
-                translated_words.append(word)
-        
-        return " ".join(translated_words)
\ No newline at end of file
+
+    def _record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def translate(self, db: Session, text: str, target_lang: str) -> str:
+        pairs = split_segments(text)
+        normalized = [normalize_segment(segment) for segment, _ in pairs]
+        hashes = {segment: segment_hash(segment) for segment in normalized if segment}
+
+        stored = {}
+        if hashes:
+            rows = (
+                db.query(TranslationSegment)
+                .filter(TranslationSegment.target_lang == target_lang,
+                        TranslationSegment.source_hash.in_(set(hashes.values())))
+                .all()
+            )
+            stored = {row.source_hash: row for row in rows}
+        translations: Dict[str, str] = {
+            segment: stored[digest].translated_text for segment, digest in hashes.items() if digest in stored
+        }
+
+        unseen = [segment for segment in hashes if segment not in translations]
+        fallback = False
+        if unseen:
+            start = time.perf_counter()
+            try:
+                translated = backend_translate(unseen, target_lang)
+            except Exception as e:
+                print(f"[WARNING] Translation backend failed, using fallback: {e}")
+                translated = [fallback_translate(segment, target_lang) for segment in unseen]
+                fallback = True
+            self._record(backend_calls=1, backend_seconds=time.perf_counter() - start)
+            translations.update(zip(unseen, translated))
+
+        self._save(db, target_lang, stored, hashes, unseen if not fallback else [], translations)
+
+        hit_chars = sum(len(segment) for segment in normalized if segment and hashes[segment] in stored)
+        self._record(
+            requests=1,
+            segments=sum(1 for segment in normalized if segment),
+            hits=sum(1 for segment in normalized if segment and hashes[segment] in stored),
+            characters=sum(len(segment) for segment in normalized),
+            characters_saved=hit_chars,
+            fallbacks=int(fallback),
+        )
+        return "".join(
+            (translations[segment] if segment else original) + separator
+            for (original, separator), segment in zip(pairs, normalized)
+        )
+
+    @staticmethod
+    def _insert_segments(db: Session, rows: List[Dict[str, str]]):
+        """Insert new segments, keeping the row of any sentence another
+        request stored first"""
+        insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}.get(db.get_bind().dialect.name)
+        if insert is not None:
+            db.execute(insert(TranslationSegment).on_conflict_do_nothing(
+                index_elements=["target_lang", "source_hash"]), rows)
+            return
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.add(TranslationSegment(**row))
+            except IntegrityError:
+                pass
+
+    def _save(self, db: Session, target_lang: str, stored: Dict[str, TranslationSegment],
+              hashes: Dict[str, str], new_segments: List[str], translations: Dict[str, str]):
+        if stored:
+            # One statement for every reused sentence, counted in the database
+            # so concurrent requests do not overwrite each other's counts
+            db.query(TranslationSegment).filter(
+                TranslationSegment.id.in_([row.id for row in stored.values()])
+            ).update({TranslationSegment.hits: TranslationSegment.hits + 1}, synchronize_session=False)
+        if new_segments:
+            self._insert_segments(db, [
+                {
+                    "target_lang": target_lang,
+                    "source_hash": hashes[segment],
+                    "source_text": segment,
+                    "translated_text": translations[segment],
+                }
+                for segment in new_segments
+            ])
+        db.commit()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["segments"], 3) if stats["segments"] else 0.0
+        stats["backend_seconds"] = round(stats["backend_seconds"], 3)
+        return stats
+
+
+translation_memory = TranslationMemory()
+
+
+def translate_text(text: str, target_lang: str, db: Optional[Session] = None) -> str:
+    """Translate text to target language, reusing stored sentence translations"""
+    if not TRANSLATION_MEMORY_ENABLED:
+        try:
+            return backend_translate([text], target_lang)[0]
+        except Exception:
+            return fallback_translate(text, target_lang)
+
+    from .database import SessionLocal
+    session = db or SessionLocal()
+    try:
+        return translation_memory.translate(session, text, target_lang)
+    finally:
+        if db is None:
+            session.close()
@@ -1,3 +1,4 @@
+import bisect
 import io
 import re
 import logging
@@ -76,10 +77,10 @@ def process_medical_file(text: str) -> Dict[str, Any]:
     try:
         processed_data = {
             "patient_info": extract_patient_info(text),
-            "diagnoses": extract_diagnoses(text),
-            "medications": extract_medications(text),
-            "symptoms": extract_symptoms(text),
-            "procedures": extract_procedures(text),
+            "diagnoses": merge_spans(extract_diagnoses(text)),
+            "medications": merge_spans(extract_medications(text)),
+            "symptoms": merge_spans(extract_symptoms(text)),
+            "procedures": merge_spans(extract_procedures(text)),
             "lab_results": extract_lab_results(text),
             "summary": generate_summary(text),
             "key_findings": extract_key_findings(text),
@@ -95,6 +96,28 @@ def process_medical_file(text: str) -> Dict[str, Any]:
         raise
 
 
+def merge_spans(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Remove overlapping spans, e.g. a section match and a gazetteer match on the same region
+    Spans are taken from the most confident down (the longer one first on a tie) and each is
+    kept only if it overlaps none of the spans already kept, so a span dropped in favour of a
+    neighbour never decides between two others. Sorting and the overlap checks are
+    O(n log n); inserting into the kept lists shifts up to n items each, so the worst case is
+    O(n^2) item moves, done by memmove and negligible for the spans of one document.
+    """
+    kept = []  # non-overlapping, so ordered by start and end alike
+    starts = []
+    ranked = sorted(spans, key=lambda s: (-s["confidence"], s["start_pos"] - s["end_pos"], s["start_pos"]))
+    for span in ranked:
+        # Of the kept spans starting before this one ends, only the last can reach into it
+        i = bisect.bisect_left(starts, span["end_pos"])
+        if i and kept[i - 1]["end_pos"] > span["start_pos"]:
+            continue
+        kept.insert(i, span)
+        starts.insert(i, span["start_pos"])
+    return kept
+
+
 def extract_patient_info(text: str) -> Dict[str, str]:
     """Extract patient information from text"""
     patient_info = {}
@@ -178,8 +201,8 @@ def extract_diagnoses(text: str) -> List[Dict[str, Any]]:
                 diagnoses.append({
                     "text": diagnosis_text,
                     "type": "diagnosis",
-                    "start_pos": match.start(),
-                    "end_pos": match.end(),
+                    "start_pos": match.start(1),
+                    "end_pos": match.start(1) + len(diagnosis_text),
                     "confidence": 0.8
                 })
     
@@ -211,8 +234,8 @@ def extract_medications(text: str) -> List[Dict[str, Any]]:
             medications.append({
                 "text": med_text,
                 "type": "medication",
-                "start_pos": match.start(),
-                "end_pos": match.end(),
+                "start_pos": match.start(1),
+                "end_pos": match.start(1) + len(med_text),
                 "confidence": 0.7
             })
     
@@ -258,8 +281,8 @@ def extract_symptoms(text: str) -> List[Dict[str, Any]]:
             symptoms.append({
                 "text": symptom_text,
                 "type": "symptom",
-                "start_pos": match.start(),
-                "end_pos": match.end(),
+                "start_pos": match.start(1),
+                "end_pos": match.start(1) + len(symptom_text),
                 "confidence": 0.7
             })
     
@@ -298,8 +321,8 @@ def extract_procedures(text: str) -> List[Dict[str, Any]]:
             procedures.append({
                 "text": procedure_text,
                 "type": "procedure",
-                "start_pos": match.start(),
-                "end_pos": match.end(),
+                "start_pos": match.start(1),
+                "end_pos": match.start(1) + len(procedure_text),
                 "confidence": 0.8
             })
     
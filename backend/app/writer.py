@@ -0,0 +1,152 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .database import SessionLocal
+from .models import Report
+
+GROUP_COMMIT_ENABLED = os.environ.get("GROUP_COMMIT_ENABLED", "").lower() in ("1", "true", "yes")
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+class GroupCommitWriter:
+    """Funnel concurrent report inserts into shared transactions.
+
+    Requests hand their Report rows to submit(); a single writer task
+    collects whatever arrives within the flush window (or until the batch
+    is full) and inserts it in one transaction, so concurrent requests pay
+    for one commit and one fsync between them. Each caller still gets the
+    id assigned to its own row. Reports for different tenant shards are
+    committed in separate transactions that run in parallel.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Flush everything already submitted, then stop the writer task"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        # Anything submitted after the stop marker is never written
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                self._resolve(item[1], error=RuntimeError("Group commit writer stopped"))
+
+    async def submit(self, report: Report, session_factory=None) -> int:
+        """Queue a report for insertion (into the shard session_factory opens,
+        default database if None) and wait for its id"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((report, future, session_factory or self.session_factory))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch: List[Tuple[Report, asyncio.Future, object]] = [item]
+
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            shards: Dict[object, List[Tuple[Report, asyncio.Future, object]]] = {}
+            for item in batch:
+                shards.setdefault(item[2], []).append(item)
+            await asyncio.gather(*(self._commit_shard(loop, factory, items) for factory, items in shards.items()))
+
+    async def _commit_shard(self, loop, session_factory, items):
+        reports = [report for report, _, _ in items]
+        try:
+            ids = await loop.run_in_executor(None, self._flush, session_factory, reports)
+        except Exception as e:
+            if len(items) == 1:
+                self._resolve(items[0][1], error=e)
+                return
+            # One bad row must not fail every request in the batch: retry
+            # each row in its own transaction so only the offender fails
+            print(f"[WARNING] Group commit of {len(items)} reports failed, retrying one by one: {e}")
+            for report, future, _ in items:
+                self._forget_keys(report)
+                try:
+                    (report_id,) = await loop.run_in_executor(None, self._flush, session_factory, [report])
+                except Exception as row_error:
+                    self._resolve(future, error=row_error)
+                else:
+                    self._resolve(future, report_id)
+            return
+        for (_, future, _), report_id in zip(items, ids):
+            self._resolve(future, report_id)
+
+    @staticmethod
+    def _forget_keys(report: Report):
+        """Clear the keys a rolled-back flush assigned; another writer may
+        have taken those ids since"""
+        report.id = None
+        if report.narrative is not None:
+            report.narrative.report_id = None
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, report_id: Optional[int] = None, error: Optional[Exception] = None):
+        # The caller may have been cancelled meanwhile
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(report_id)
+
+    def _flush(self, session_factory, reports: List[Report]) -> List[int]:
+        """Insert a batch in one transaction and return the assigned ids"""
+        db = session_factory()
+        try:
+            # With SQLAlchemy 2.0 on SQLite >= 3.35 the flush is a single
+            # multi-row INSERT ... RETURNING; older versions issue one
+            # statement per row, still inside the one transaction.
+            db.add_all(reports)
+            db.flush()
+            ids = [report.id for report in reports]
+            db.commit()
+            return ids
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+writer = GroupCommitWriter()
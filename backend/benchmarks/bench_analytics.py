@@ -0,0 +1,78 @@
+"""Query latency of the in-memory analytics store.
+
+Run from the backend directory (numpy installed):
+
+    python benchmarks/bench_analytics.py [--reports 1000000]
+
+Loads synthetic report metadata straight into an AnalyticsStore (no
+database) and reports the best of 20 runs of each query shape.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.analytics import AnalyticsStore  # noqa: E402
+
+DRUGS = [f"Drug {i}" for i in range(500)]
+EVENTS = ["nausea", "headache", "dizziness", "rash", "fever", "fatigue", "vomiting", "insomnia"]
+SEVERITIES = ["mild", "moderate", "severe", "unknown"]
+OUTCOMES = ["recovered", "ongoing", "fatal", "unknown"]
+
+QUERIES = {
+    "count, no filter": {},
+    "drug filter": {"drug": "Drug 7"},
+    "drug + severity filter": {"drug": "Drug 7", "severity": "severe"},
+    "adverse event filter": {"adverse_event": "rash"},
+    "date range filter": {"since": datetime.datetime(2024, 3, 1), "until": datetime.datetime(2024, 6, 1)},
+    "group by severity": {"group_by": "severity"},
+    "group by drug": {"group_by": "drug"},
+    "group by adverse event": {"group_by": "adverse_event"},
+    "event filter, group by drug": {"adverse_event": "rash", "group_by": "drug"},
+}
+
+
+def build(count: int) -> AnalyticsStore:
+    rng = random.Random(42)
+    start = datetime.datetime(2024, 1, 1)
+    store = AnalyticsStore()
+    batch = []
+    for report_id in range(1, count + 1):
+        batch.append((
+            report_id,
+            rng.choice(DRUGS),
+            rng.choice(SEVERITIES),
+            rng.choice(OUTCOMES),
+            ",".join(rng.sample(EVENTS, rng.randint(1, 3))),
+            start + datetime.timedelta(seconds=rng.randrange(365 * 86400)),
+        ))
+        if len(batch) == 100000:
+            store._extend_rows(batch)
+            batch = []
+    store._extend_rows(batch)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    store = build(args.reports)
+    print(f"{args.reports} reports, {store.memory_bytes() / 1e6:.1f} MB")
+    for name, query in QUERIES.items():
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            store.query(**query)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<30} {min(timings) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Commits/sec of the per-request write path against the group-commit writer.
+
+Run from the backend directory:
+
+    python benchmarks/bench_group_commit.py [--reports 2000] [--concurrency 64]
+
+Both paths write to a fresh temporary SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.database import Base  # noqa: E402
+from app.models import Report  # noqa: E402
+from app.writer import GroupCommitWriter  # noqa: E402
+
+
+def make_report(i: int) -> Report:
+    return Report(
+        report_text=f"Patient experienced nausea after taking Drug X. Case {i}.",
+        drug="Drug X",
+        adverse_events="nausea",
+        severity="mild",
+        outcome="recovered",
+    )
+
+
+def make_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+async def per_request(session_factory, count: int, concurrency: int):
+    """The current path: every request commits its own row"""
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    def write(i: int):
+        db = session_factory()
+        try:
+            report = make_report(i)
+            db.add(report)
+            db.commit()
+            db.refresh(report)
+            return report.id
+        finally:
+            db.close()
+
+    async def handle(i: int):
+        async with semaphore:
+            return await loop.run_in_executor(None, write, i)
+
+    return await asyncio.gather(*(handle(i) for i in range(count)))
+
+
+async def group_commit(session_factory, count: int, concurrency: int, window_ms: float, max_batch: int):
+    writer = GroupCommitWriter(session_factory, window_ms=window_ms, max_batch=max_batch)
+    await writer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(i: int):
+        async with semaphore:
+            return await writer.submit(make_report(i))
+
+    try:
+        return await asyncio.gather(*(handle(i) for i in range(count)))
+    finally:
+        await writer.stop()
+
+
+def run(name: str, coro_factory, count: int):
+    with tempfile.TemporaryDirectory() as directory:
+        engine, session_factory = make_session_factory(os.path.join(directory, "bench.db"))
+        start = time.perf_counter()
+        ids = asyncio.run(coro_factory(session_factory))
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+    assert len(set(ids)) == count, "every request must get its own id"
+    print(f"{name:<28}{count / elapsed:>12.0f} reports/sec{elapsed:>10.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{args.reports} reports, {args.concurrency} concurrent requests")
+    run("per-request commit", lambda sf: per_request(sf, args.reports, args.concurrency), args.reports)
+    run(
+        f"group commit ({args.window_ms:g} ms/{args.max_batch})",
+        lambda sf: group_commit(sf, args.reports, args.concurrency, args.window_ms, args.max_batch),
+        args.reports,
+    )
+
+
+if __name__ == "__main__":
+    main()
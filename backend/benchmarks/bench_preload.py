@@ -0,0 +1,147 @@
+"""Memory and throughput of the gunicorn launcher with and without preload_app.
+
+Run from the backend directory (Linux only, gunicorn and uvicorn installed):
+
+    python benchmarks/bench_preload.py [--workers 4] [--seconds 20] [--concurrency 16]
+
+Each mode starts `gunicorn -c gunicorn.conf.py app.main:app` in a fresh
+temporary directory (so it gets its own reports.db), POSTs reports to
+/process-report for the given time, then reads Rss, Pss and private memory of
+the master and every worker from /proc/<pid>/smaps_rollup. Memory is read
+after the load, once the workers' collectors have run. Set
+EXTRACTION_STRATEGY and friends in the environment as for the server.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+REPORT = (
+    "Patient experienced severe nausea and headache after taking Drug X. "
+    "Symptoms of dizziness were reported on day two. The patient recovered."
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int):
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid follows it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+    return found
+
+
+def memory(pid: int):
+    """Rss, Pss and private (USS) memory of a process in KiB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+async def load(url: str, seconds: float, concurrency: int) -> int:
+    deadline = time.monotonic() + seconds
+    completed = 0
+
+    async def client():
+        nonlocal completed
+        async with httpx.AsyncClient(base_url=url, timeout=60) as http:
+            while time.monotonic() < deadline:
+                response = await http.post("/process-report", json={"report": REPORT})
+                response.raise_for_status()
+                completed += 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return completed
+
+
+def wait_ready(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run(preload: bool, workers: int, seconds: float, concurrency: int):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PRELOAD_APP="1" if preload else "0", WEB_CONCURRENCY=str(workers),
+               BIND=f"127.0.0.1:{port}", MAX_REQUESTS="0")
+    with tempfile.TemporaryDirectory() as workdir:
+        master = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", os.path.join(BACKEND, "gunicorn.conf.py"),
+             "--chdir", workdir, "--pythonpath", os.path.abspath(BACKEND), "app.main:app"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(url)
+            # Warm every worker up before timing
+            asyncio.run(load(url, 2, concurrency))
+            completed = asyncio.run(load(url, seconds, concurrency))
+            processes = [master.pid] + children(master.pid)
+            usage = [memory(pid) for pid in processes]
+        finally:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=60)
+
+    worker_usage = usage[1:]
+    return {
+        "requests/s": completed / seconds,
+        "worker rss": sum(u["rss"] for u in worker_usage) / len(worker_usage),
+        "worker uss": sum(u["uss"] for u in worker_usage) / len(worker_usage),
+        "total pss": sum(u["pss"] for u in usage),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'mode':<28} {'req/s':>8} {'worker RSS':>12} {'worker USS':>12} {'total PSS':>12}")
+    for preload in (False, True):
+        result = run(preload, args.workers, args.seconds, args.concurrency)
+        mode = "preload_app + gc.freeze" if preload else "no preload"
+        print(f"{mode:<28} {result['requests/s']:>8.1f} "
+              f"{result['worker rss'] / 1024:>9.1f} MB {result['worker uss'] / 1024:>9.1f} MB "
+              f"{result['total pss'] / 1024:>9.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
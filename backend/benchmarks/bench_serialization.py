@@ -0,0 +1,112 @@
+"""Bytes and CPU time per 10k reports for each response format.
+
+Run from the backend directory:
+
+    python benchmarks/bench_serialization.py [--reports 10000]
+
+Formats whose libraries are not installed are skipped.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+DRUGS = ["Drug A", "Drug B", "Aspirin", "Metformin", "Lisinopril", "Ibuprofen"]
+EVENTS = ["nausea", "headache", "dizziness", "rash", "fever", "fatigue", "vomiting"]
+SEVERITIES = ["mild", "moderate", "severe", "unknown"]
+OUTCOMES = ["recovered", "ongoing", "fatal", "unknown"]
+
+
+def make_reports(count: int):
+    rng = random.Random(42)
+    now = datetime.datetime(2025, 1, 1)
+    reports = []
+    for i in range(count):
+        drug = rng.choice(DRUGS)
+        events = rng.sample(EVENTS, rng.randint(1, 3))
+        severity = rng.choice(SEVERITIES)
+        outcome = rng.choice(OUTCOMES)
+        reports.append({
+            "id": i + 1,
+            "drug": drug,
+            "adverse_events": events,
+            "severity": severity,
+            "outcome": outcome,
+            "original_report": (
+                f"Patient experienced {', '.join(events)} after taking {drug}. "
+                f"Symptoms were {severity}. Patient {outcome}."
+            ),
+            "created_at": (now + datetime.timedelta(minutes=i)).isoformat(),
+        })
+    return reports
+
+
+def measure(fn, repeat: int = 5):
+    """Return (result, best CPU seconds) over a few runs"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = fn()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=10000)
+    args = parser.parse_args()
+
+    reports = make_reports(args.reports)
+
+    encoders = {}
+    if jsonable_encoder is not None:
+        encoders["jsonable_encoder + json"] = lambda: json.dumps(jsonable_encoder(reports)).encode("utf-8")
+    encoders["json"] = lambda: json.dumps(reports).encode("utf-8")
+    if orjson is not None:
+        encoders["orjson"] = lambda: orjson.dumps(reports)
+    if msgpack is not None:
+        encoders["msgpack"] = lambda: msgpack.packb(reports, use_bin_type=True)
+
+    compressors = {"identity": None, "gzip": lambda body: gzip.compress(body, compresslevel=5)}
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=4)
+
+    print(f"{args.reports} reports")
+    print(f"{'format':<26}{'encoding':<10}{'bytes':>12}{'encode ms':>12}{'compress ms':>13}")
+    for name, encode in encoders.items():
+        body, encode_time = measure(encode)
+        for encoding, compressor in compressors.items():
+            if compressor is None:
+                size, compress_time = len(body), 0.0
+            else:
+                compressed, compress_time = measure(lambda: compressor(body), repeat=3)
+                size = len(compressed)
+            print(f"{name:<26}{encoding:<10}{size:>12}{encode_time * 1000:>12.1f}{compress_time * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
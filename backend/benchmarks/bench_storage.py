@@ -0,0 +1,139 @@
+"""Database size and metadata scan time with and without compressed narratives.
+
+Run from the backend directory:
+
+    python benchmarks/bench_storage.py [--reports 20000]
+
+Builds the same synthetic corpus three times in temporary SQLite files:
+narratives inline in the reports table (the old layout), moved to
+report_narratives with plain zstd (or zlib), and with a trained zstd
+dictionary.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.database import Base  # noqa: E402
+from app.models import Report  # noqa: E402
+from app.narratives import codec, compress_existing, train_dictionary, zstandard  # noqa: E402
+
+DRUGS = ["Drug A", "Drug B", "Aspirin", "Metformin", "Lisinopril", "Ibuprofen", "Atorvastatin"]
+EVENTS = ["nausea", "headache", "dizziness", "rash", "fever", "fatigue", "vomiting", "insomnia"]
+BOILERPLATE = [
+    "This report was received from a healthcare professional via the spontaneous reporting system.",
+    "The reporter considered the event to be possibly related to the suspect product.",
+    "No further information is expected. The case is considered closed.",
+    "Concomitant medications were not reported. Medical history was unremarkable.",
+    "Follow-up information was requested from the reporter on the outcome of the events.",
+    "The batch number was not provided and the lot could not be traced.",
+]
+
+
+def make_narrative(rng: random.Random) -> str:
+    drug = rng.choice(DRUGS)
+    events = rng.sample(EVENTS, rng.randint(1, 3))
+    sentences = [
+        f"A {rng.randint(18, 90)}-year-old {rng.choice(['male', 'female'])} patient started {drug} "
+        f"{rng.randint(5, 1000)} mg {rng.choice(['daily', 'twice daily', 'weekly'])} on day {rng.randint(1, 30)}.",
+        f"After {rng.randint(1, 60)} days the patient experienced {', '.join(events)}.",
+        f"Symptoms were {rng.choice(['mild', 'moderate', 'severe'])} and the patient "
+        f"{rng.choice(['recovered', 'is ongoing', 'was discharged'])} after {rng.randint(1, 20)} days.",
+    ]
+    sentences += rng.sample(BOILERPLATE, rng.randint(2, 5))
+    rng.shuffle(sentences)
+    return " ".join(sentences)
+
+
+def build(path: str, count: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    rng = random.Random(42)
+    start = datetime.datetime(2024, 1, 1)
+    session.add_all([
+        Report(
+            report_text=make_narrative(rng),
+            drug=rng.choice(DRUGS),
+            adverse_events=",".join(rng.sample(EVENTS, 2)),
+            severity=rng.choice(["mild", "moderate", "severe"]),
+            outcome=rng.choice(["recovered", "ongoing", "unknown"]),
+            created_at=start + datetime.timedelta(minutes=i),
+            extraction_version=1,
+        )
+        for i in range(count)
+    ])
+    session.commit()
+    return engine, session
+
+
+def vacuum(engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+
+
+SCANS = {
+    "fetch": "SELECT id, drug, adverse_events, severity, outcome, created_at FROM reports",
+    "group by": "SELECT severity, outcome, count(*) FROM reports GROUP BY severity, outcome",
+}
+
+
+def scan_ms(engine, query: str, repeat: int = 5) -> float:
+    """Best time for a full scan of the metadata columns"""
+    best = None
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(text(query)).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def report(name: str, engine, path: str):
+    timings = "".join(f"{scan_ms(engine, query):>12.1f} ms" for query in SCANS.values())
+    print(f"{name:<28}{os.path.getsize(path) / 1e6:>10.2f} MB{timings}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{args.reports} reports")
+    print(f"{'layout':<28}{'db size':>13}" + "".join(f"{name + ' scan':>15}" for name in SCANS))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "inline.db")
+        engine, session = build(path, args.reports)
+        session.close()
+        report("inline report_text", engine, path)
+
+        path = os.path.join(directory, "compressed.db")
+        engine, session = build(path, args.reports)
+        codec.reset()
+        compress_existing(session, 1000)
+        session.close()
+        vacuum(engine)
+        report("zstd" if zstandard else "zlib", engine, path)
+
+        if zstandard is not None:
+            path = os.path.join(directory, "dictionary.db")
+            engine, session = build(path, args.reports)
+            codec.reset()
+            train_dictionary(session, samples=5000, size=16 * 1024)
+            compress_existing(session, 1000)
+            session.close()
+            vacuum(engine)
+            report("zstd + trained dictionary", engine, path)
+
+
+if __name__ == "__main__":
+    main()
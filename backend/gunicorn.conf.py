@@ -0,0 +1,47 @@
+"""Production launcher configuration.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app (and with it the spaCy model) is imported once in the master process
+and the workers are forked from it, so they share the model's memory pages
+copy-on-write instead of each loading their own copy.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# Extraction is CPU-bound, so one worker per core is the sensible default.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Set to 0 to have every worker import the app (and load the model) itself
+preload_app = os.environ.get("PRELOAD_APP", "1").lower() in ("1", "true", "yes")
+
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot grow without bound
+max_requests = int(os.environ.get("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", "500"))
+
+
+def on_starting(server):
+    """Runs once in the master, after the app has been preloaded"""
+    from app.database import engine, init_db
+
+    init_db()
+    # Never share pooled SQLite connections across fork
+    engine.dispose()
+
+    if not preload_app:
+        server.log.info("Schema ready; forking %s workers", workers)
+        return
+
+    # Move everything allocated so far (the model included) into the permanent
+    # generation, so the collector in each worker never touches those pages
+    # and they stay shared.
+    gc.freeze()
+    server.log.info("Schema ready and app preloaded; forking %s workers", workers)
@@ -230,6 +230,1139 @@ class TestMedicalTextProcessing:
         assert any("diabetes" in text for text in diagnosis_texts)
 
 
+class TestEntityIndex:
+    """Test span merging and the persisted entity index"""
+    
+    def test_merge_spans(self):
+        """Test that overlapping spans keep the most confident, then longest"""
+        from app.utils import merge_spans
+        
+        spans = [
+            {"text": "Metformin 500mg, Aspirin", "start_pos": 13, "end_pos": 37, "confidence": 0.7},
+            {"text": "Metformin", "start_pos": 13, "end_pos": 22, "confidence": 0.9},
+            {"text": "Aspirin", "start_pos": 30, "end_pos": 37, "confidence": 0.9},
+            {"text": "chest pain", "start_pos": 50, "end_pos": 60, "confidence": 0.8},
+            {"text": "pain", "start_pos": 56, "end_pos": 60, "confidence": 0.8},
+        ]
+        
+        merged = merge_spans(spans)
+        assert [span["text"] for span in merged] == ["Metformin", "Aspirin", "chest pain"]
+
+        # B displaces A and C displaces B, but A never overlapped C
+        chain = [
+            {"text": "A", "start_pos": 0, "end_pos": 10, "confidence": 0.8},
+            {"text": "B", "start_pos": 5, "end_pos": 15, "confidence": 0.9},
+            {"text": "C", "start_pos": 12, "end_pos": 20, "confidence": 0.95},
+        ]
+        assert [span["text"] for span in merge_spans(chain)] == ["A", "C"]
+    
+    def test_search_by_entity(self):
+        """Test finding documents through the entity index"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app.database import Base
+        from app.documents import document_entities, search_entities, store_document
+        from app.utils import process_medical_file
+        
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        
+        text = "Diagnosis: Type 2 Diabetes\nMedications: Metformin 500mg daily\n"
+        document = store_document(db, "a.txt", "text/plain", text, process_medical_file(text))
+        store_document(db, "b.txt", "text/plain", "Medications: Aspirin", process_medical_file("Medications: Aspirin"))
+        
+        results = search_entities(db, "medication", "METFORMIN")
+        assert [result["id"] for result in results] == [document.id]
+        match = results[0]["matches"][0]
+        assert text[match["start_pos"]:match["end_pos"]] == "Metformin"
+        
+        diagnoses = document_entities(db, document.id, "diagnosis")
+        assert diagnoses[0]["text"] == "Type 2 Diabetes"
+        assert document_entities(db, 999) is None
+
+
+class TestResponseFormats:
+    """Test content negotiation and compression of encoded responses"""
+    
+    def _client(self):
+        from fastapi import FastAPI, Request
+        from fastapi.testclient import TestClient
+        from app.serialization import encode_response
+        
+        app = FastAPI()
+        
+        @app.get("/data")
+        async def data(request: Request):
+            return encode_response(request, [{"id": i, "drug": "Aspirin"} for i in range(200)])
+        
+        return TestClient(app)
+    
+    def test_content_negotiation(self):
+        """Test that MessagePack is only sent when it ranks above JSON"""
+        pytest.importorskip("msgpack")
+        client = self._client()
+        
+        def media_type(accept):
+            return client.get("/data", headers={"Accept": accept}).headers["content-type"]
+        
+        assert media_type("application/msgpack") == "application/msgpack"
+        assert media_type("application/json;q=0.5, application/x-msgpack") == "application/msgpack"
+        assert media_type("application/msgpack;q=0") == "application/json"
+        assert media_type("application/msgpack;q=0.5, application/json") == "application/json"
+        assert media_type("*/*") == "application/json"
+    
+    def test_compression_headers(self):
+        """Test Content-Encoding selection and the Vary header"""
+        client = self._client()
+        
+        gzipped = client.get("/data", headers={"Accept-Encoding": "gzip"})
+        assert gzipped.headers["content-encoding"] == "gzip"
+        assert gzipped.headers["vary"] == "Accept, Accept-Encoding"
+        assert len(gzipped.json()) == 200
+        
+        refused = client.get("/data", headers={"Accept-Encoding": "gzip;q=0, br;q=0"})
+        assert "content-encoding" not in refused.headers
+        assert refused.headers["vary"] == "Accept, Accept-Encoding"
+        
+        from app.serialization import brotli
+        if brotli is not None:
+            preferred = client.get("/data", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+            assert preferred.headers["content-encoding"] == "br"
+
+
+class TestHttpCaching:
+    """Test conditional GET and the response cache"""
+    
+    def _client(self):
+        from fastapi import FastAPI, Request
+        from fastapi.testclient import TestClient
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from app import caching, changes  # noqa: F401
+        from app.database import Base
+        from app.models import Report
+        
+        caching.response_cache.invalidate()
+        sessions = {}
+        for tenant in ("", "acme"):
+            engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+            Base.metadata.create_all(bind=engine)
+            sessions[tenant] = sessionmaker(bind=engine)
+        
+        app = FastAPI()
+        
+        @app.get("/reports")
+        def reports(request: Request):
+            db = sessions[request.headers.get("x-tenant-id", "")]()
+            try:
+                return caching.cached_response(request, db, lambda: [drug for (drug,) in db.query(Report.drug)])
+            finally:
+                db.close()
+        
+        def write(tenant, change):
+            db = sessions[tenant]()
+            change(db)
+            db.commit()
+            db.close()
+            caching.invalidate()
+        
+        return TestClient(app), write
+    
+    def _add(self, drug):
+        from app.models import Report
+        return lambda db: db.add(Report(drug=drug, adverse_events="rash", severity="mild", outcome="recovered"))
+    
+    def test_etag_and_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 until the data changes"""
+        from app.models import Report
+        client, write = self._client()
+        write("", self._add("Drug A"))
+        
+        first = client.get("/reports")
+        assert first.json() == ["Drug A"]
+        etag = first.headers["etag"]
+        assert "last-modified" in first.headers
+        
+        cached = client.get("/reports", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        
+        # An update leaves id, count and created_at alone but still changes the ETag
+        write("", lambda db: setattr(db.query(Report).one(), "drug", "Drug B"))
+        changed = client.get("/reports", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.json() == ["Drug B"]
+        assert changed.headers["etag"] != etag
+    
+    def test_tenant_header_is_part_of_cache_key(self):
+        """Test that tenants never see each other's cached responses"""
+        client, write = self._client()
+        write("", self._add("Drug A"))
+        write("acme", self._add("Drug B"))
+        
+        assert client.get("/reports").json() == ["Drug A"]
+        assert client.get("/reports", headers={"X-Tenant-ID": "acme"}).json() == ["Drug B"]
+        assert client.get("/reports").json() == ["Drug A"]
+
+
+class TestExtractionStrategies:
+    """Test the rule-based adverse event extraction path"""
+    
+    def test_rules_only_extraction(self):
+        """Test that rules-only extraction finds keywords without spaCy"""
+        from app.extraction import extract_adverse_events
+        
+        text = "Patient experienced nausea and headache after taking Drug X."
+        events = extract_adverse_events(text, "rules-only")
+        assert sorted(events) == ["headache", "nausea"]
+    
+    def test_rule_confidence(self):
+        """Test that keywords after a trigger phrase are trusted more"""
+        from app.extraction import rule_adverse_events
+        
+        _, triggered = rule_adverse_events("Patient reported dizziness.")
+        _, untriggered = rule_adverse_events("Dizziness was noted on day two.")
+        _, missing = rule_adverse_events("No adverse events.")
+        assert triggered > untriggered > missing
+    
+    def test_unknown_strategy(self):
+        """Test that an unknown strategy is rejected"""
+        from app.extraction import extract_adverse_events
+        
+        with pytest.raises(ValueError):
+            extract_adverse_events("Patient reported nausea.", "fastest")
+    
+    def test_cascade_keeps_rules_when_ner_is_empty(self, monkeypatch):
+        """Test that a low-confidence keyword hit survives an empty NER result"""
+        from app import extraction
+        
+        loads = []
+        monkeypatch.setattr(extraction.model_cache, "get", lambda language: loads.append(language) or object())
+        monkeypatch.setattr(extraction, "ner_adverse_events", lambda text, nlp, pipeline: [])
+        
+        assert extraction.extract_adverse_events("Dizziness was noted on day two.", "cascade") == ["dizziness"]
+        assert loads == ["en"]
+        
+        # A confident keyword pass never loads the model
+        assert extraction.extract_adverse_events("Patient reported nausea.", "cascade") == ["nausea"]
+        assert loads == ["en"]
+
+
+class TestAdmissionControl:
+    """Test rate limiting and fair scheduling"""
+    
+    def test_token_bucket(self):
+        """Test that a bucket allows its burst, then asks the client to wait"""
+        from app.admission import TokenBucket
+        
+        bucket = TokenBucket(per_minute=60, burst=2)
+        assert bucket.take() == 0
+        assert bucket.take() == 0
+        assert 0 < bucket.take() <= 1
+    
+    def test_identify(self):
+        """Test that only allow-listed API keys identify a client and set its class"""
+        from starlette.requests import Request
+        from app.admission import AdmissionController
+        
+        controller = AdmissionController(api_keys={"partner", "batch"}, bulk_clients={"batch"}, anonymous_class="bulk")
+        
+        def identify(**headers):
+            scope = {"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()],
+                     "client": ("10.0.0.5", 1234)}
+            return controller.identify(Request(scope))
+        
+        assert identify(x_api_key="partner") == ("key:partner", "interactive")
+        assert identify(x_api_key="partner", x_request_class="bulk") == ("key:partner", "bulk")
+        assert identify(x_api_key="batch", x_request_class="interactive") == ("key:batch", "bulk")
+        assert identify(x_api_key="made-up") == ("ip:10.0.0.5", "bulk")
+        assert identify() == ("ip:10.0.0.5", "bulk")
+    
+    def test_interactive_served_before_bulk(self):
+        """Test that waiting interactive requests overtake queued bulk ones"""
+        from app.admission import FairScheduler
+        
+        async def scenario():
+            scheduler = FairScheduler(slots=1)
+            order = []
+            
+            async def job(client, weight):
+                await scheduler.acquire(client, weight)
+                order.append(client)
+                await asyncio.sleep(0)
+                scheduler.release()
+            
+            await scheduler.acquire("holder", 1)
+            tasks = [asyncio.ensure_future(job("bulk", 1)) for _ in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.ensure_future(job("interactive", 8)))
+            await asyncio.sleep(0)
+            scheduler.release()
+            await asyncio.gather(*tasks)
+            return order
+        
+        order = asyncio.run(scenario())
+        assert order.index("interactive") < 2
+
+
+class TestProfiling:
+    """Test sampled request profiling and the admin endpoints"""
+    
+    def _client(self, monkeypatch, tmp_path, token=None, sample_rate=0.0):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from app import profiling
+        
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(profiling, "ADMIN_TOKEN", token)
+        monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", sample_rate)
+        monkeypatch.setattr(profiling, "PROFILER", "cprofile")
+        app = FastAPI()
+        
+        @app.post("/process-report")
+        def process_report():
+            return {"status": "ok"}
+        
+        @app.get("/reports")
+        def reports():
+            return []
+        
+        profiling.install(app)
+        return TestClient(app)
+    
+    def test_admin_endpoints_fail_closed(self, monkeypatch, tmp_path):
+        """Test that the endpoints do not exist without a token and refuse a wrong one"""
+        client = self._client(monkeypatch, tmp_path)
+        assert client.get("/admin/profiles").status_code == 404
+        assert client.get("/admin/profiles", headers={"X-Admin-Token": ""}).status_code == 404
+        
+        client = self._client(monkeypatch, tmp_path, token="secret")
+        assert client.get("/admin/profiles").status_code == 403
+        assert client.get("/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert client.get("/admin/profiles", headers={"X-Admin-Token": "secret"}).json() == []
+    
+    def test_debug_header_requires_admin(self, monkeypatch, tmp_path):
+        """Test that only admins can force a profile, and only on profiled paths"""
+        client = self._client(monkeypatch, tmp_path, token="secret")
+        admin = {"X-Debug-Profile": "1", "X-Admin-Token": "secret"}
+        
+        assert "x-profile-id" not in client.post("/process-report", headers={"X-Debug-Profile": "1"}).headers
+        assert "x-profile-id" not in client.get("/reports", headers=admin).headers
+        profile_id = client.post("/process-report", headers=admin).headers["x-profile-id"]
+        
+        listed = client.get("/admin/profiles", headers={"X-Admin-Token": "secret"}).json()
+        assert [meta["id"] for meta in listed] == [profile_id]
+        assert listed[0]["path"] == "/process-report"
+        download = client.get(f"/admin/profiles/{profile_id}", headers={"X-Admin-Token": "secret"})
+        assert download.status_code == 200
+        assert client.get("/admin/profiles/nothere", headers={"X-Admin-Token": "secret"}).status_code == 404
+    
+    def test_sampling(self, monkeypatch, tmp_path):
+        """Test that sampled requests are profiled without any header"""
+        client = self._client(monkeypatch, tmp_path, sample_rate=1.0)
+        assert "x-profile-id" in client.post("/process-report").headers
+        assert "x-profile-id" not in client.get("/reports").headers
+    
+    def test_one_profile_at_a_time(self, monkeypatch, tmp_path):
+        """Test that a request arriving while another is profiled is served unprofiled"""
+        from app import profiling
+        client = self._client(monkeypatch, tmp_path, sample_rate=1.0)
+        
+        assert profiling._profiling_lock.acquire(blocking=False)
+        try:
+            response = client.post("/process-report")
+        finally:
+            profiling._profiling_lock.release()
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+        assert "x-profile-id" in client.post("/process-report").headers
+    
+    def test_store_evicts_oldest(self, tmp_path):
+        """Test the on-disk ring buffer and the profile id guard"""
+        from app.profiling import ProfileStore
+        
+        store = ProfileStore(str(tmp_path), max_profiles=2)
+        for age, profile_id in enumerate(["first", "second", "third"]):
+            store.save({"id": profile_id, "profiler": "cprofile"}, lambda path: open(path, "w").close())
+            os.utime(tmp_path / f"{profile_id}.json", (age, age))
+        store._evict()
+        
+        assert sorted(meta["id"] for meta in store.list()) == ["second", "third"]
+        assert sorted(os.listdir(tmp_path)) == ["second.json", "second.prof", "third.json", "third.prof"]
+        assert store.get("third")["filename"] == "third.prof"
+        assert store.get("../third") is None
+
+
+class TestGroupCommit:
+    """Test the group-commit writer"""
+    
+    def _writer(self, **kwargs):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from app.database import Base
+        from app.writer import GroupCommitWriter
+        
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        writer = GroupCommitWriter(sessionmaker(bind=engine), **kwargs)
+        flushes = []
+        flush = writer._flush
+        
+        def counting_flush(session_factory, reports):
+            flushes.append(len(reports))
+            return flush(session_factory, reports)
+        
+        writer._flush = counting_flush
+        return writer, flushes
+    
+    def _report(self, drug="Drug X"):
+        from app.models import Report
+        return Report(drug=drug, adverse_events="nausea", severity="mild", outcome="recovered")
+    
+    def test_concurrent_reports_share_one_commit(self):
+        """Test that reports arriving within the window are committed together"""
+        writer, flushes = self._writer(window_ms=50, max_batch=64)
+        
+        async def scenario():
+            await writer.start()
+            ids = await asyncio.gather(*(writer.submit(self._report()) for _ in range(10)))
+            await writer.stop()
+            return ids
+        
+        assert sorted(asyncio.run(scenario())) == list(range(1, 11))
+        assert flushes == [10]
+    
+    def test_flush_on_window_and_size(self):
+        """Test that a lone report waits out the window and a full batch does not wait"""
+        import time
+        writer, flushes = self._writer(window_ms=200, max_batch=3)
+        
+        async def scenario():
+            await writer.start()
+            start = time.perf_counter()
+            await writer.submit(self._report())
+            lone = time.perf_counter() - start
+            start = time.perf_counter()
+            await asyncio.gather(*(writer.submit(self._report()) for _ in range(3)))
+            full = time.perf_counter() - start
+            await writer.stop()
+            return lone, full
+        
+        lone, full = asyncio.run(scenario())
+        assert lone >= 0.2
+        assert full < 0.2
+        assert flushes == [1, 3]
+    
+    def test_bad_row_only_fails_its_own_request(self):
+        """Test that a failed batch is retried row by row"""
+        from sqlalchemy.exc import IntegrityError
+        writer, flushes = self._writer(window_ms=50)
+        
+        async def scenario():
+            await writer.start()
+            results = await asyncio.gather(
+                writer.submit(self._report()), writer.submit(self._report(drug=None)), writer.submit(self._report()),
+                return_exceptions=True,
+            )
+            await writer.stop()
+            return results
+        
+        first, bad, last = asyncio.run(scenario())
+        assert isinstance(bad, IntegrityError)
+        assert isinstance(first, int) and isinstance(last, int) and first != last
+        assert flushes == [3, 1, 1, 1]
+    
+    def test_retried_rows_get_fresh_ids(self):
+        """Test that a retried row does not reuse the id its failed batch assigned"""
+        from sqlalchemy.exc import IntegrityError
+        from app.models import ReportNarrative
+        writer, flushes = self._writer(window_ms=50)
+        flush = writer._flush
+        
+        def racing_flush(session_factory, reports):
+            try:
+                return flush(session_factory, reports)
+            except IntegrityError:
+                # Another writer takes the ids the failed batch had assigned
+                db = session_factory()
+                db.add(self._report(drug="Other"))
+                db.commit()
+                db.close()
+                raise
+        writer._flush = racing_flush
+        
+        good, bad = self._report(), self._report()
+        good.narrative = ReportNarrative(codec="zlib", body=b"narrative")
+        # The reports insert succeeds and hands out ids, the narratives insert fails
+        bad.narrative = ReportNarrative(codec="zlib", body=None)
+        
+        async def scenario():
+            await writer.start()
+            results = await asyncio.gather(writer.submit(good), writer.submit(bad), return_exceptions=True)
+            await writer.stop()
+            return results
+        
+        good_id, error = asyncio.run(scenario())
+        assert isinstance(error, IntegrityError)
+        assert good_id == 2
+        db = writer.session_factory()
+        assert [report_id for (report_id,) in db.query(ReportNarrative.report_id)] == [2]
+        db.close()
+    
+    def test_stop_drains_submitted_reports(self):
+        """Test that stop() commits everything submitted before it"""
+        writer, flushes = self._writer(window_ms=1000)
+        
+        async def scenario():
+            await writer.start()
+            tasks = [asyncio.ensure_future(writer.submit(self._report())) for _ in range(5)]
+            await asyncio.sleep(0)
+            await writer.stop()
+            return await asyncio.gather(*tasks)
+        
+        assert sorted(asyncio.run(scenario())) == list(range(1, 6))
+        assert sum(flushes) == 5
+
+
+class TestLanguageRouting:
+    """Test language detection and per-language extraction"""
+    
+    def test_detect_language(self):
+        """Test offline language identification"""
+        from app.language import detect_language
+        
+        assert detect_language("The patient experienced nausea after taking the drug.") == "en"
+        assert detect_language("Le patient a présenté des nausées après la prise du médicament.") == "fr"
+        assert detect_language("Mgonjwa alipata kichefuchefu baada ya kutumia dawa.") == "sw"
+    
+    def test_french_report_uses_french_tables(self):
+        """Test that a French narrative is extracted with the French pipeline"""
+        from app.extraction import extract_report
+        
+        extracted = extract_report(
+            "Le patient sous Metformine a présenté des nausées et une fièvre sévère. Il est rétabli.",
+            "rules-only"
+        )
+        
+        assert extracted["language"] == "fr"
+        assert sorted(extracted["adverse_events"]) == ["fever", "nausea"]
+        assert extracted["severity"] == "severe"
+        assert extracted["outcome"] == "recovered"
+    
+    def test_swahili_report_without_model_falls_back_to_rules(self):
+        """Test that a language without a spaCy model uses the keyword pass"""
+        from app.extraction import extract_report
+        
+        extracted = extract_report("Mgonjwa alipata maumivu ya kichwa kali baada ya kutumia dawa.", "ner-only")
+        
+        assert extracted["language"] == "sw"
+        assert extracted["adverse_events"] == ["headache"]
+        assert extracted["severity"] == "severe"
+
+    def test_model_load_does_not_block_other_languages(self, monkeypatch):
+        """Test that a slow model load only holds up its own language"""
+        import threading
+        from app.extraction import ModelCache
+
+        cache = ModelCache(max_models=2)
+        loading = threading.Event()
+        release = threading.Event()
+        loads = []
+
+        def load(language, model):
+            loads.append(language)
+            if language == "fr":
+                loading.set()
+                release.wait(5)
+            return object()
+
+        monkeypatch.setattr(cache, "_load", load)
+        english = cache.get("en")
+        threads = [threading.Thread(target=cache.get, args=("fr",)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        assert loading.wait(5)
+        # The French load is in progress, English is still served
+        assert cache.get("en") is english
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        assert loads == ["en", "fr"]
+
+
+class TestNarrativeStorage:
+    """Test compressed narratives and monthly archival"""
+    
+    def _session(self, path="", **info):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import changes  # noqa: F401
+        from app.database import Base
+        
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        return sessionmaker(bind=engine, info=info)()
+    
+    def test_attach_and_read_narrative(self, monkeypatch):
+        """Test the compress/decompress round trip with every codec"""
+        from app import narratives
+        from app.models import NarrativeDictionary, Report
+        
+        text = "Patient experienced nausea after taking Drug X. Symptoms resolved after 3 days. " * 3
+        db = self._session(shard="roundtrip")
+        narratives.codec.reset()
+        
+        def store():
+            report = Report(drug="Drug X", adverse_events="nausea", severity="mild", outcome="recovered")
+            narratives.attach_narrative(db, report, text)
+            db.add(report)
+            db.commit()
+            return report
+        
+        codecs = ["zlib"]
+        if narratives.zstandard is not None:
+            codecs.append("zstd")
+            plain = store()
+            db.add(NarrativeDictionary(data=narratives.zstandard.train_dictionary(1024, [
+                f"Patient {i} experienced {event} after taking Drug {i % 7}. Outcome: {i % 3}.".encode()
+                for i in range(400) for event in ("nausea", "rash")
+            ]).as_bytes(), sample_count=800))
+            db.commit()
+            narratives.codec.reset()
+            with_dictionary = store()
+            assert plain.narrative.dictionary_id is None
+            assert with_dictionary.narrative.dictionary_id is not None
+        # Without zstandard new narratives fall back to zlib
+        monkeypatch.setattr(narratives, "zstandard", None)
+        assert store().narrative.codec == "zlib"
+        monkeypatch.undo()
+        
+        reports = db.query(Report).all()
+        assert {report.narrative.codec for report in reports} == set(codecs)
+        for report in reports:
+            assert report.report_text == ""
+            assert len(report.narrative.body) < len(text)
+            assert narratives.narrative_text(db, report) == text
+        narratives.codec.reset()
+    
+    def test_train_dictionary_needs_a_corpus(self):
+        """Test that training on an empty database fails cleanly"""
+        from app import narratives
+        if narratives.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        
+        with pytest.raises(ValueError):
+            narratives.train_dictionary(self._session(), 100, 1024)
+    
+    def test_archive_moves_reports_by_month(self, tmp_path, monkeypatch):
+        """Test that old reports move to their month's archive with their narratives"""
+        import datetime
+        from app import archive, narratives
+        from app.models import Report
+        
+        monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+        monkeypatch.setattr(archive, "_sessionmakers", {})
+        db = self._session(tmp_path / "reports.db")
+        for created_at, drug in [(datetime.datetime(2023, 1, 5), "Drug A"), (datetime.datetime(2023, 1, 20), "Drug B"),
+                                 (datetime.datetime(2023, 2, 1), "Drug C"), (datetime.datetime.utcnow(), "Drug D")]:
+            report = Report(drug=drug, adverse_events="rash", severity="mild", outcome="recovered", created_at=created_at)
+            narratives.attach_narrative(db, report, f"Narrative of {drug}")
+            db.add(report)
+        db.commit()
+        
+        moved = archive.archive_reports(db, datetime.datetime(2024, 1, 1), batch_size=2)
+        assert moved == 3
+        assert [drug for (drug,) in db.query(Report.drug)] == ["Drug D"]
+        assert archive.list_months() == ["2023-01", "2023-02"]
+        assert archive.count_reports("2023-01") == 2
+        
+        archived = archive.archive_session("2023-02")
+        report = archived.query(Report).one()
+        assert (report.id, report.drug) == (3, "Drug C")
+        assert narratives.narrative_text(archived, report) == "Narrative of Drug C"
+        archived.close()
+        with pytest.raises(FileNotFoundError):
+            archive.archive_session("2023-03")
+
+
+class TestAnalyticsStore:
+    """Test the in-memory analytics store against SQL"""
+    
+    def test_store_matches_sql_after_updates_and_deletes(self):
+        """Test that counts and group-bys equal a SQL GROUP BY as reports change"""
+        pytest.importorskip("numpy")
+        import random
+        from sqlalchemy import create_engine, func
+        from sqlalchemy.orm import sessionmaker
+        from app import analytics, changes
+        from app.database import Base
+        from app.models import Report
+        
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        rng = random.Random(7)
+        
+        def add(count):
+            for _ in range(count):
+                db.add(Report(drug=rng.choice(["Drug A", "Drug B", "Aspirin"]),
+                              severity=rng.choice(["mild", "severe"]),
+                              outcome=rng.choice(["recovered", "ongoing"]),
+                              adverse_events=",".join(rng.sample(["nausea", "rash", "fever"], 2))))
+            db.commit()
+        
+        def check(store):
+            for field in ("drug", "severity", "outcome"):
+                column = getattr(Report, field)
+                expected = dict(db.query(column, func.count(Report.id)).group_by(column).all())
+                assert store.query(group_by=field)["groups"] == expected
+            expected = db.query(Report).filter(Report.drug == "Aspirin", Report.severity == "severe").count()
+            assert store.query(drug="Aspirin", severity="severe")["count"] == expected
+            expected = db.query(Report).filter(Report.adverse_events.contains("rash")).count()
+            assert store.query(adverse_event="rash")["count"] == expected
+        
+        add(200)
+        store = analytics.AnalyticsStore()
+        store.compact_min_dead = 0
+        store.refresh(db, force=True)
+        check(store)
+        
+        add(50)
+        for report in db.query(Report).filter(Report.id % 3 == 0):
+            report.severity = "mild" if report.severity == "severe" else "severe"
+        for report in db.query(Report).filter(Report.id % 5 == 0):
+            db.delete(report)
+        db.commit()
+        store.refresh(db, force=True)
+        check(store)
+        assert store.query()["count"] == db.query(Report).count()
+        
+        # Bulk deletes log their own changes; with most rows dead the store
+        # compacts, which must not change any result
+        db.query(Report).filter(Report.id > 20).delete(synchronize_session=False)
+        changes.record_changes(db, range(21, 251), "delete")
+        db.commit()
+        store.refresh(db, force=True)
+        assert store.dead_count == 0 and store.size == 20 - 4
+        check(store)
+
+
+class TestReportStream:
+    """Test the server-sent event broadcaster"""
+    
+    def _report(self, report_id):
+        return {"id": report_id, "drug": "Drug X", "adverse_events": ["nausea"], "severity": "mild", "outcome": "recovered"}
+    
+    def _frames(self, subscriber):
+        frames = []
+        while not subscriber.queue.empty():
+            frames.append(subscriber.queue.get_nowait())
+        return frames
+    
+    def test_publish_reaches_the_tenants_subscribers(self):
+        """Test that each subscriber gets its own tenant's reports and deltas"""
+        from app.events import Broadcaster
+        
+        async def scenario():
+            broadcaster = Broadcaster()
+            default = broadcaster.subscribe()
+            acme = broadcaster.subscribe(deltas=True, tenant="acme")
+            broadcaster.publish(self._report(1))
+            broadcaster.publish(self._report(2), "acme")
+            return self._frames(default), self._frames(acme)
+        
+        default, acme = asyncio.run(scenario())
+        assert len(default) == 1 and default[0].startswith(b"event: report\nid: 1\n")
+        assert [frame.split(b"\n")[0] for frame in acme] == [b"event: report", b"event: stats"]
+    
+    def test_disconnect_and_slow_consumers(self):
+        """Test that closed streams unsubscribe and full buffers are dropped"""
+        from app.events import Broadcaster
+        
+        async def scenario():
+            broadcaster = Broadcaster(buffer_size=2)
+            subscriber = broadcaster.subscribe()
+            stream = broadcaster.stream(subscriber)
+            assert await stream.__anext__() == b"retry: 5000\n\n"
+            await stream.aclose()
+            disconnected = subscriber not in broadcaster.subscribers
+            
+            slow = broadcaster.subscribe()
+            for report_id in range(3):
+                broadcaster.publish(self._report(report_id))
+            return disconnected, slow, broadcaster
+        
+        disconnected, slow, broadcaster = asyncio.run(scenario())
+        assert disconnected
+        assert slow.dropped and slow not in broadcaster.subscribers
+        assert broadcaster.dropped_total == 1
+        assert self._frames(slow) == [None]
+    
+    def test_reconnect_replays_missed_reports(self):
+        """Test Last-Event-ID replay, and resync when the id is gone"""
+        from app.events import Broadcaster
+        
+        async def scenario():
+            broadcaster = Broadcaster(replay_size=3)
+            for report_id in (1, 3, 2, 4):
+                broadcaster.publish(self._report(report_id))
+            replayed = broadcaster.subscribe(last_event_id=3)
+            evicted = broadcaster.subscribe(last_event_id=1)
+            other_tenant = broadcaster.subscribe(tenant="acme", last_event_id=3)
+            return [self._frames(subscriber) for subscriber in (replayed, evicted, other_tenant)]
+        
+        replayed, evicted, other_tenant = asyncio.run(scenario())
+        # Publish order is kept: 2 was published after 3
+        assert [frame.split(b"\n")[1] for frame in replayed] == [b"id: 2", b"id: 4"]
+        assert evicted[0].startswith(b"event: resync")
+        assert other_tenant[0].startswith(b"event: resync")
+
+
+    def test_change_log_tailer_publishes_other_writers_reports(self):
+        """Test that reports committed by another process reach this worker's streams"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from app import changes  # noqa: F401
+        from app.database import Base
+        from app.events import Broadcaster, ChangeLogTailer
+        from app.models import Report
+        
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        sessions = sessionmaker(bind=engine)
+        
+        def write(*drugs):
+            db = sessions()
+            for drug in drugs:
+                db.add(Report(drug=drug, adverse_events="rash", severity="mild", outcome="recovered"))
+            db.commit()
+            db.close()
+        
+        write("Before")
+        serialize = lambda db, report: {**self._report(report.id), "drug": report.drug}
+        
+        async def scenario():
+            broadcaster = Broadcaster()
+            tailer = ChangeLogTailer(broadcaster, lambda tenant: sessions(), serialize, interval=0.01)
+            await tailer.start()
+            subscriber = broadcaster.subscribe()
+            write("Drug A", "Drug B")
+            db = sessions()
+            db.query(Report).filter(Report.drug == "Drug A").one().severity = "severe"
+            db.commit()
+            db.close()
+            await asyncio.sleep(0.2)
+            await tailer.stop()
+            return self._frames(subscriber)
+        
+        frames = asyncio.run(scenario())
+        assert [frame.split(b"\n")[1] for frame in frames] == [b"id: 2", b"id: 3"]
+        assert b'"drug":"Drug A"' in frames[0]
+
+
+class TestReprocess:
+    """Test re-extraction of reports stored by an older extraction version"""
+    
+    def test_reprocess_shard(self, tmp_path, monkeypatch):
+        """Test version selection, chunking and the bulk update"""
+        from concurrent.futures import ThreadPoolExecutor
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import changes, reprocess  # noqa: F401
+        from app.database import Base
+        from app.extraction import EXTRACTION_VERSION
+        from app.models import Report, ReportChange
+        
+        engine = create_engine(f"sqlite:///{tmp_path}/reports.db")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        db = session_factory()
+        text = "Patient experienced nausea after taking Drug X."
+        for version, language in [(None, None), (1, "fr"), (EXTRACTION_VERSION, "en"), (1, "en"), (1, "en"), (None, "sw")]:
+            db.add(Report(report_text=text, drug="?", adverse_events="?", severity="?", outcome="?",
+                          extraction_version=version, language=language))
+        db.commit()
+        seq = db.query(ReportChange.seq).count()
+        db.close()
+        
+        chunks = []
+        reprocess_chunk = reprocess.reprocess_chunk
+        
+        def recording_chunk(rows, strategy):
+            chunks.append([row[0] for row in rows])
+            return reprocess_chunk(rows, strategy)
+        
+        monkeypatch.setattr(reprocess, "reprocess_chunk", recording_chunk)
+        with ThreadPoolExecutor(2) as pool:
+            processed = reprocess.reprocess_shard(pool, session_factory, workers=2, chunk_size=2, pause=0,
+                                                  strategy="rules-only", checkpoint_path=str(tmp_path / "checkpoint.json"))
+        
+        assert processed == 5
+        assert chunks == [[1, 2], [4, 5], [6]]
+        db = session_factory()
+        reports = db.query(Report).order_by(Report.id).all()
+        assert {report.extraction_version for report in reports} == {EXTRACTION_VERSION}
+        assert [report.drug for report in reports] == ["Drug X", "Drug X", "?", "Drug X", "Drug X", "Drug X"]
+        # Stored languages are kept; only the row without one is detected
+        assert [report.language for report in reports] == ["en", "fr", "en", "en", "en", "sw"]
+        assert db.query(ReportChange.seq).count() - seq == 5
+        db.close()
+    
+    def test_unknown_strategy_is_rejected_up_front(self):
+        """Test that a bad strategy fails before any worker starts"""
+        from app.reprocess import reprocess
+        
+        with pytest.raises(ValueError):
+            reprocess(workers=1, chunk_size=10, pause=0, strategy="fastest")
+
+
+class TestTenantShards:
+    """Test per-tenant shard routing"""
+    
+    def test_tenants_are_isolated(self, tmp_path):
+        """Test that each tenant reads and writes its own shard"""
+        from app.models import Report
+        from app.tenants import ShardRouter
+        
+        router = ShardRouter(f"sqlite:///{tmp_path}/{{tenant}}.db", max_engines=1)
+        for tenant, drug in [("acme", "Drug A"), ("globex", "Drug B"), ("acme", "Drug C")]:
+            db = router.session(tenant)
+            db.add(Report(drug=drug, adverse_events="rash", severity="mild", outcome="recovered"))
+            db.commit()
+            db.close()
+        
+        db = router.session("acme")
+        assert sorted(drug for (drug,) in db.query(Report.drug)) == ["Drug A", "Drug C"]
+        db.close()
+        assert router.tenants() == ["acme", "globex"]
+        assert router.open_count() == 1
+    
+    def test_invalid_tenant(self):
+        """Test that tenant ids cannot escape the shard directory"""
+        from app.tenants import validate_tenant
+        
+        assert validate_tenant(" ACME ") == "acme"
+        with pytest.raises(ValueError):
+            validate_tenant("../reports")
+
+    def test_unknown_tenant_is_rejected(self, monkeypatch):
+        """Test that only tenants listed in TENANTS are routed"""
+        from fastapi import HTTPException
+        from starlette.requests import Request
+        from app import tenants
+
+        monkeypatch.setattr(tenants, "TENANTS", frozenset({"acme"}))
+        request = lambda tenant: Request({"type": "http", "query_string": b"",
+                                          "headers": [(b"x-tenant-id", tenant.encode())]})
+        assert tenants.tenant_from_request(request("ACME")) == "acme"
+        with pytest.raises(HTTPException) as error:
+            tenants.tenant_from_request(request("globex"))
+        assert error.value.status_code == 404
+
+    def test_dropped_shard_is_not_reused(self, tmp_path):
+        """Test that a shard deleted by another process is reopened, and scans leave the cache alone"""
+        from app.models import Report
+        from app.narratives import codec
+        from app.tenants import ShardRouter
+
+        router = ShardRouter(f"sqlite:///{tmp_path}/{{tenant}}.db", max_engines=1)
+        db = router.session("acme")
+        db.add(Report(drug="Drug A", adverse_events="rash", severity="mild", outcome="recovered"))
+        db.commit()
+        db.close()
+        db = router.session("globex")
+        db.add(Report(drug="Drug B", adverse_events="rash", severity="mild", outcome="recovered"))
+        db.commit()
+        db.close()
+
+        # Reading acme does not evict globex, the open shard
+        with router.scan("acme") as db:
+            assert db.query(Report).count() == 1
+        assert router.open_count() == 1
+        assert router.shard("globex") is router.shard("globex")
+
+        # `python -m app.tenants drop` in another process
+        codec._current_dictionary_ids["globex"] = 1
+        ShardRouter(f"sqlite:///{tmp_path}/{{tenant}}.db").drop("globex")
+        codec._current_dictionary_ids["globex"] = 1
+        db = router.session("globex")
+        assert db.query(Report).count() == 0
+        # Narratives in the new shard must not name the old shard's dictionary
+        assert codec._current_dictionary_id(db) is None
+        db.close()
+
+
+class TestChangeLog:
+    """Test the report change log behind /reports/changes"""
+    
+    def test_changes_since(self):
+        """Test paging through inserts, updates and deletes"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app.changes import changes_since
+        from app.database import Base
+        from app.models import Report
+        
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        for drug in ("Drug A", "Drug B", "Drug C"):
+            db.add(Report(drug=drug, adverse_events="rash", severity="mild", outcome="recovered"))
+        db.commit()
+        db.query(Report).filter(Report.drug == "Drug A").one().severity = "severe"
+        db.delete(db.query(Report).filter(Report.drug == "Drug B").one())
+        db.commit()
+        
+        serialize = lambda db, report: {"drug": report.drug, "severity": report.severity}
+        first = changes_since(db, 0, 2, serialize)
+        assert [change["id"] for change in first["changes"]] == [1, 2]
+        assert first["has_more"] is True
+        
+        rest = changes_since(db, first["next_cursor"], 10, serialize)
+        assert [(change["op"], change["id"]) for change in rest["changes"]] == [
+            ("upsert", 3), ("upsert", 1), ("delete", 2)
+        ]
+        assert rest["changes"][1]["report"]["severity"] == "severe"
+        assert rest["has_more"] is False
+        assert changes_since(db, rest["next_cursor"], 10, serialize)["changes"] == []
+
+    def test_archive_copies_are_not_logged(self):
+        """Test that writes through an archive session leave the change log alone"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import changes  # noqa: F401
+        from app.database import Base
+        from app.models import Report, ReportChange
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        archive = sessionmaker(bind=engine, info={"shard": None, "archive": True})()
+        archive.merge(Report(id=7, drug="Drug A", adverse_events="rash", severity="mild", outcome="recovered"))
+        archive.commit()
+
+        assert archive.query(Report).count() == 1
+        assert archive.query(ReportChange).count() == 0
+
+
+class TestTranslationMemory:
+    """Test sentence-level translation memory"""
+    
+    def _session(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app.database import Base
+        from app import models  # noqa: F401
+        
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        return sessionmaker(bind=engine)()
+    
+    def test_only_unseen_segments_are_sent(self, monkeypatch):
+        """Test that stored sentences are reused and new ones batched"""
+        from app import translation
+        
+        calls = []
+        def fake_backend(texts, target_lang):
+            calls.append(list(texts))
+            return [f"[{target_lang}] {text}" for text in texts]
+        monkeypatch.setattr(translation, "backend_translate", fake_backend)
+        
+        memory = translation.TranslationMemory()
+        db = self._session()
+        memory.translate(db, "Patient recovered. No rash.", "fr")
+        translated = memory.translate(db, "No  rash. Follow up in two weeks.", "fr")
+        
+        assert translated == "[fr] No rash. [fr] Follow up in two weeks."
+        assert calls == [["Patient recovered.", "No rash."], ["Follow up in two weeks."]]
+        assert memory.snapshot()["hits"] == 1
+    
+    def test_fallback_translations_are_not_stored(self, monkeypatch):
+        """Test that a backend failure does not poison the memory"""
+        from app import translation
+        from app.models import TranslationSegment
+        
+        def failing_backend(texts, target_lang):
+            raise ConnectionError("offline")
+        monkeypatch.setattr(translation, "backend_translate", failing_backend)
+        
+        db = self._session()
+        translated = translation.TranslationMemory().translate(db, "Severe.", "fr")
+        
+        assert translated == "severe."
+        assert db.query(TranslationSegment).count() == 0
+
+    def test_concurrently_stored_segment_keeps_batch(self, monkeypatch):
+        """Test that a sentence stored meanwhile by another request does not drop the rest"""
+        from app import translation
+        from app.models import TranslationSegment
+
+        monkeypatch.setattr(translation, "backend_translate",
+                            lambda texts, target_lang: [f"[{target_lang}] {text}" for text in texts])
+        memory = translation.TranslationMemory()
+        db = self._session()
+        memory.translate(db, "Patient recovered.", "fr")
+        stored = {row.source_hash: row for row in db.query(TranslationSegment)}
+        # Another request stores "No rash." after this one looked it up
+        db.add(TranslationSegment(target_lang="fr", source_hash=translation.segment_hash("No rash."),
+                                  source_text="No rash.", translated_text="Pas d'éruption."))
+        db.commit()
+
+        segments = ["Patient recovered.", "No rash.", "Follow up."]
+        memory._save(db, "fr", stored, {segment: translation.segment_hash(segment) for segment in segments},
+                     ["No rash.", "Follow up."], {segment: f"[fr] {segment}" for segment in segments})
+
+        rows = {row.source_text: row for row in db.query(TranslationSegment)}
+        assert sorted(rows) == ["Follow up.", "No rash.", "Patient recovered."]
+        assert rows["No rash."].translated_text == "Pas d'éruption."
+        assert rows["Patient recovered."].hits == 1
+
+    def test_segment_insert_compiles_for_postgres(self):
+        """Test that tenant schemas on Postgres get a Postgres upsert"""
+        from types import SimpleNamespace
+        from sqlalchemy.dialects import postgresql
+        from app.translation import TranslationMemory
+
+        dialect = postgresql.dialect()
+        statements = []
+        db = SimpleNamespace(
+            get_bind=lambda: SimpleNamespace(dialect=dialect),
+            execute=lambda statement, rows: statements.append(str(statement.compile(dialect=dialect))),
+        )
+        TranslationMemory._insert_segments(db, [{"target_lang": "fr", "source_hash": "x",
+                                                 "source_text": "Rash.", "translated_text": "Éruption."}])
+        assert statements[0].endswith("ON CONFLICT (target_lang, source_hash) DO NOTHING")
+
+    def test_backend_translates_repeatedly(self, monkeypatch):
+        """Test that consecutive backend calls each get a working translator"""
+        from types import SimpleNamespace
+        from app import translation
+
+        class LoopBoundTranslator:
+            """Like googletrans 4: the HTTP client binds to the first event loop"""
+            shared_loop = None
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def translate(self, texts, dest):
+                loop = asyncio.get_running_loop()
+                if self.shared_loop not in (None, loop):
+                    raise RuntimeError("Event loop is closed")
+                self.shared_loop = loop
+                return [SimpleNamespace(text=f"[{dest}] {text}") for text in texts]
+        monkeypatch.setattr(translation, "Translator", LoopBoundTranslator)
+
+        assert translation.backend_translate(["Rash."], "fr") == ["[fr] Rash."]
+        assert translation.backend_translate(["Fever.", "Nausea."], "sw") == ["[sw] Fever.", "[sw] Nausea."]
+
+
 class TestTranslationServices:
     """Test translation functionality"""
     
@@ -1,15 +1,30 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import Head from 'next/head';
 import ReportForm from '../components/ReportForm';
 import ReportResults from '../components/ReportResults';
 import ReportHistory from '../components/ReportHistory';
 import Charts from '../components/Charts';
-import { getReports } from '../services/api';
+import { getReportChanges, getReports, subscribeToReports } from '../services/api';
+
+// Apply /reports/changes entries to a report list, newest first
+const applyChanges = (current, changes) => {
+  const byId = new Map(current.map((report) => [report.id, report]));
+  changes.forEach((change) => {
+    if (change.op === 'delete') {
+      byId.delete(change.id);
+    } else {
+      byId.set(change.id, change.report);
+    }
+  });
+  return [...byId.values()].sort((a, b) => b.created_at.localeCompare(a.created_at));
+};
 
 export default function Home() {
   const [currentReport, setCurrentReport] = useState(null);
   const [reports, setReports] = useState([]);
   const [activeTab, setActiveTab] = useState('process');
+  // Change log position the list is up to date with, null until first synced
+  const cursor = useRef(null);
 
   const loadReports = async () => {
     try {
@@ -20,13 +35,45 @@ export default function Home() {
     }
   };
 
+  // Fetch only what changed since the cursor instead of the whole list
+  const syncChanges = async () => {
+    try {
+      let since = cursor.current === null ? 0 : cursor.current;
+      let page;
+      do {
+        page = await getReportChanges(since);
+        const { changes } = page;
+        setReports((current) => applyChanges(current, changes));
+        since = page.next_cursor;
+      } while (page.has_more);
+      cursor.current = since;
+    } catch (error) {
+      console.error('Error syncing reports:', error);
+    }
+  };
+
+  const resync = async () => {
+    if (cursor.current === null) {
+      // Reports stored before the change log existed are only in /reports
+      await loadReports();
+    }
+    await syncChanges();
+  };
+
   useEffect(() => {
-    loadReports();
+    resync();
+    // Add reports processed elsewhere as soon as the backend commits them,
+    // and catch up through the change log if the stream may have missed some
+    return subscribeToReports((report) => {
+      setReports((current) =>
+        current.some((existing) => existing.id === report.id) ? current : [report, ...current]
+      );
+    }, resync);
   }, []);
 
   const handleReportProcessed = (newReport) => {
     setCurrentReport(newReport);
-    loadReports(); // Refresh the list
+    syncChanges(); // Refresh the list
   };
 
   return (
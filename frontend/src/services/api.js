@@ -23,6 +23,39 @@ export const getReports = async () => {
   return response.data;
 };
 
+// Pull reports inserted, updated or deleted since a cursor (0 for
+// everything). Call again with next_cursor while has_more is true, and keep
+// the last next_cursor for the next sync.
+export const getReportChanges = async (since = 0, limit = 500) => {
+  const response = await api.get('/reports/changes', { params: { since, limit } });
+  return response.data;
+};
+
+// Subscribe to newly processed reports pushed by the backend as server-sent
+// events. The browser reconnects on its own and the backend replays what it
+// still has buffered; onResync is called after every reconnect, and when the
+// backend could not replay, so the caller can catch up through getReportChanges.
+// Returns a function that closes the stream.
+export const subscribeToReports = (onReport, onResync) => {
+  const source = new EventSource(`${API_BASE_URL}/reports/stream`);
+  let connected = false;
+  source.addEventListener('open', () => {
+    if (connected && onResync) {
+      onResync();
+    }
+    connected = true;
+  });
+  source.addEventListener('report', (event) => {
+    onReport(JSON.parse(event.data));
+  });
+  source.addEventListener('resync', () => {
+    if (onResync) {
+      onResync();
+    }
+  });
+  return () => source.close();
+};
+
 export const translateText = async (translationData) => {
   const response = await api.post('/translate', translationData);
   return response.data;